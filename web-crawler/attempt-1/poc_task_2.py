@@ -7,6 +7,8 @@ We need to exclude external links.
 import requests
 from bs4 import BeautifulSoup
 
+CONNECT_READ_TIMEOUT = (10, 30)
+
 website_link = 'https://qualibar.com/'
 
 all_urls = []
@@ -28,7 +30,12 @@ while len(urls) != 0:
 
     # crawling logic
     if website_link in current_url and current_url not in all_urls:
-        response = requests.get(current_url)
+        try:
+            response = requests.get(current_url, timeout=CONNECT_READ_TIMEOUT)
+        except requests.RequestException as e:
+            print(f'Failed to fetch {current_url}: {e}')
+            rejected_urls.append(current_url)
+            continue
         soup = BeautifulSoup(response.content, "html.parser")
 
         all_urls.append(current_url)
@@ -8,14 +8,47 @@
 # pylint: disable=C0301
 
 # Import all modules
+import asyncio
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse, urlunparse, urldefrag
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPResponse, HTTPSConnectionPool
+from urllib3.exceptions import HTTPError as Urllib3Error
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from bs4 import BeautifulSoup, SoupStrainer
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    # Links are then extracted with BeautifulSoup's SoupStrainer
+    lxml_etree = None
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlunparse
+from urllib.robotparser import RobotFileParser
 import time
 from tqdm import tqdm
 from rich.progress import Progress, BarColumn, TextColumn
 import pyfiglet
 import os
+import random
+import bisect
+import codecs
+import fnmatch
+import gzip
+import hashlib
+import io
+import heapq
+import itertools
+import json
+import math
+import queue
+import sqlite3
+import tempfile
+import threading
+import uuid
+import re
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
@@ -47,34 +80,2208 @@ class Node:
     Node class to represent each URL and its children
     """
 
-    def __init__(self, url):
+    def __init__(self, url, depth=0):
         self.url = url
+        self.depth = depth
+        self.parent = None
         self.children = []
 
     def add_child(self, child_node):
+        child_node.parent = self
         self.children.append(child_node)
 
     def __repr__(self):
         return f"Node(url={self.url}, children={len(self.children)})"
 
 
+def is_html_content_type(content_type):
+    """
+    Check if a Content-Type header value is an HTML page
+    """
+    media_type = content_type.split(";")[0].strip().lower()
+    return media_type in ("text/html", "application/xhtml+xml")
+
+
+def text_encoding(encoding):
+    """
+    Codec to decode a page with, utf-8 when it declares none or one Python
+    cannot decode text with (charset=foobar, base64)
+    """
+    if encoding:
+        try:
+            codec = codecs.lookup(encoding)
+        except LookupError:
+            return "utf-8"
+        if getattr(codec, "_is_text_encoding", True):
+            return codec.name
+    return "utf-8"
+
+
+class LinkExtractor:
+    """
+    Finds the href of every <a> tag of a page, in document order. The
+    crawler turns them into links, so all extractors give the same Nodes
+    """
+
+    name = None
+
+    def hrefs(self, html):
+        raise NotImplementedError
+
+    def incremental(self):
+        """
+        Parser fed the page piece by piece as it downloads
+        """
+        return BufferedHrefParser(self)
+
+
+class BufferedHrefParser:
+    """
+    Incremental parser for extractors that need the whole page, the hrefs
+    only come out once it is closed
+    """
+
+    def __init__(self, extractor):
+        self.extractor = extractor
+        self.parts = []
+
+    def feed(self, text):
+        """
+        Add the next piece of the page, return the hrefs completed by it
+        """
+        self.parts.append(text)
+        return []
+
+    def close(self):
+        """
+        Return the remaining hrefs
+        """
+        return self.extractor.hrefs("".join(self.parts))
+
+
+class SoupLinkExtractor(LinkExtractor):
+    """
+    Full BeautifulSoup tree with the pure Python html.parser
+    """
+
+    name = "soup"
+
+    def hrefs(self, html):
+        soup = BeautifulSoup(html, "html.parser")
+        return [link["href"] for link in soup.find_all("a", href=True)]
+
+
+class StrainerLinkExtractor(LinkExtractor):
+    """
+    BeautifulSoup that only builds the <a href> elements
+    """
+
+    name = "strainer"
+
+    def hrefs(self, html):
+        soup = BeautifulSoup(html, "html.parser", parse_only=SoupStrainer("a", href=True))
+        return [link["href"] for link in soup.find_all("a", href=True)]
+
+
+class HrefTarget:
+    """
+    lxml parser target collecting hrefs from the start tag events, no tree is built
+    """
+
+    def __init__(self):
+        self.hrefs = []
+
+    def start(self, tag, attrib):
+        if tag == "a":
+            href = attrib.get("href")
+            if href is not None:
+                self.hrefs.append(href)
+
+    def close(self):
+        return self.hrefs
+
+
+class LxmlHrefParser:
+    """
+    libxml2 push parser, hrefs come out as soon as their start tag arrived
+    """
+
+    def __init__(self):
+        self.target = HrefTarget()
+        self.parser = lxml_etree.HTMLParser(target=self.target)
+        self.emitted = 0
+
+    def feed(self, text):
+        if text:
+            self.parser.feed(text)
+        return self.new_hrefs()
+
+    def close(self):
+        try:
+            self.parser.close()
+        except lxml_etree.LxmlError:
+            pass
+        return self.new_hrefs()
+
+    def new_hrefs(self):
+        hrefs = self.target.hrefs[self.emitted:]
+        self.emitted = len(self.target.hrefs)
+        return hrefs
+
+
+class LxmlLinkExtractor(LinkExtractor):
+    """
+    libxml2's HTML parser feeding SAX-style events to an HrefTarget
+    """
+
+    name = "lxml"
+
+    def incremental(self):
+        return LxmlHrefParser()
+
+    def hrefs(self, html):
+        target = HrefTarget()
+        parser = lxml_etree.HTMLParser(target=target)
+        try:
+            parser.feed(html)
+            parser.close()
+        except lxml_etree.LxmlError:
+            # Nothing parseable, e.g. an empty body
+            pass
+        return target.hrefs
+
+
+link_extractors = {
+    extractor.name: extractor
+    for extractor in (LxmlLinkExtractor, StrainerLinkExtractor, SoupLinkExtractor)
+    if extractor is not LxmlLinkExtractor or lxml_etree is not None
+}
+default_link_extractor = "lxml" if "lxml" in link_extractors else "strainer"
+
+
+class StreamingLinks:
+    """
+    Finds the links of a page while it downloads, handing each one to
+    `on_link` as soon as its <a> tag has arrived
+    """
+
+    def __init__(self, crawler, url, on_link=None):
+        self.crawler = crawler
+        self.url = url
+        self.on_link = on_link
+        self.parser = None
+        self.links = []
+
+    def start(self):
+        """
+        Called when a download (re)starts
+        """
+        self.parser = self.crawler.link_extractor.incremental()
+        self.links = []
+
+    def feed(self, text):
+        self.add(self.parser.feed(text))
+
+    def add(self, hrefs):
+        for href in hrefs:
+            link = self.crawler.link_from_href(self.url, href)
+            if link:
+                self.links.append(link)
+                if self.on_link:
+                    self.on_link(link)
+
+    def result(self, url, html):
+        """
+        All links of the page, parsed from scratch when the body did not stream
+        in (e.g. it came from the HTTP cache)
+        """
+        if self.parser is None:
+            return self.crawler.extract_links(url, html)
+        self.add(self.parser.close())
+        return self.links
+
+
+class ScopeMatcher:
+    """
+    Compiled crawl scope: a suffix trie of the allowed hosts (each with its
+    subdomains), a trie of allowed path prefixes, and regex allow/deny
+    rules. Checking a URL is one walk down each trie plus one regex search,
+    however many hosts and prefixes there are
+    """
+
+    def __init__(self, hosts, path_prefixes=(), allow=(), deny=()):
+        # What the matcher was built from, part of the key of the cached links
+        self.settings = (sorted(hosts), sorted(path_prefixes), list(allow), list(deny))
+        # Nested dicts keyed by host label from the right, None marks an allowed host
+        self.hosts = {}
+        for host in hosts:
+            self.add_host(host)
+        # Same for path segments, None when any path is allowed
+        self.paths = None
+        for prefix in path_prefixes:
+            self.add_path(prefix)
+        self.allow = self.compile(allow)
+        self.deny = self.compile(deny)
+
+    @staticmethod
+    def compile(patterns):
+        return re.compile("|".join(f"(?:{pattern})" for pattern in patterns)) if patterns else None
+
+    @staticmethod
+    def host_labels(netloc):
+        # Any port of an allowed host is in scope, like in QueryPolicy.site_rule()
+        host = netloc.rpartition("@")[2].partition(":")[0].lower().rstrip(".").removeprefix("www.")
+        return reversed(host.split("."))
+
+    def add_host(self, host):
+        node = self.hosts
+        for label in self.host_labels(host):
+            node = node.setdefault(label, {})
+        node[None] = True
+
+    def add_path(self, prefix):
+        if self.paths is None:
+            self.paths = {}
+        node = self.paths
+        for segment in prefix.split("/"):
+            if segment:
+                node = node.setdefault(segment, {})
+        node[None] = True
+
+    def host_allowed(self, netloc):
+        node = self.hosts
+        for label in self.host_labels(netloc):
+            node = node.get(label)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+    def path_allowed(self, path):
+        node = self.paths
+        if node is None or None in node:
+            return True
+        for segment in path.split("/"):
+            if not segment:
+                continue
+            node = node.get(segment)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+    def allows(self, url, netloc=None, path=None):
+        """
+        Check if the URL is in scope, `netloc` and `path` save parsing it again
+        """
+        if netloc is None:
+            parsed = urlparse(url)
+            netloc, path = parsed.netloc, parsed.path
+        if not self.host_allowed(netloc) or not self.path_allowed(path):
+            return False
+        if self.deny and self.deny.search(url):
+            return False
+        return self.allow is None or self.allow.search(url) is not None
+
+
+class OutOfScope(Exception):
+    """
+    Raised by the redirect hooks to stop a redirect chain before it leaves the crawl scope
+    """
+
+
+class AlreadyCrawled(Exception):
+    """
+    Raised by the redirect hooks to stop a redirect chain that leads to a page
+    which was already crawled, instead of downloading the page again
+    """
+
+
+class QueryPolicy:
+    """
+    Canonical form of a URL's query string. Tracking and session parameters
+    are dropped, the rest are kept (or only those on the `keep` list) and
+    sorted by name, so ?page=2 and ?id=17 stay distinct pages while
+    ?id=17&utm_source=x and ?utm_source=y&id=17 are one. Names may be
+    shell-style patterns such as utm_*. `sites` maps a host (with its
+    subdomains) to its own {"keep": [...], "drop": [...]} rules, a site's
+    keep list replaces the default one and its drop list adds to the default
+    """
+
+    tracking_params = (
+        "utm_*", "gclid", "gclsrc", "dclid", "fbclid", "msclkid", "yclid", "igshid",
+        "mc_cid", "mc_eid", "_ga", "_gl", "_hsenc", "_hsmi", "ref_src",
+    )
+    session_params = (
+        "sid", "sessid", "sessionid", "session_id", "phpsessid", "jsessionid",
+        "aspsessionid*", "cfid", "cftoken",
+    )
+
+    def __init__(self, keep=None, drop=(), sort=True, sites=None):
+        # What the policy was built from, part of the key of the cached links
+        self.settings = (keep, list(drop), sort, sites)
+        self.sort = sort
+        self.default = self.rule(keep, (*self.tracking_params, *self.session_params, *drop))
+        self.sites = {}
+        for host, rules in (sites or {}).items():
+            site_keep = rules.get("keep", keep)
+            site_drop = (*self.tracking_params, *self.session_params, *drop, *rules.get("drop", ()))
+            self.sites[host.lower().removeprefix("www.")] = self.rule(site_keep, site_drop)
+
+    @staticmethod
+    def compile(names):
+        return re.compile("|".join(fnmatch.translate(name.lower()) for name in names)) if names else None
+
+    def rule(self, keep, drop):
+        """
+        (keep pattern, drop pattern), a keep pattern of None keeps every parameter not dropped
+        """
+        if keep is not None and not keep:
+            # An empty keep list drops the whole query
+            return False, None
+        return self.compile(keep) if keep else None, self.compile(drop)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """
+        Load the per-site rules from a JSON file of {host: {"keep": [...], "drop": [...]}}
+        """
+        with open(path) as rules_file:
+            return cls(sites=json.load(rules_file), **kwargs)
+
+    def site_rule(self, netloc):
+        host = netloc.rpartition("@")[2].partition(":")[0].lower().removeprefix("www.")
+        while host:
+            if host in self.sites:
+                return self.sites[host]
+            host = host.partition(".")[2]
+        return self.default
+
+    def canonical(self, netloc, query):
+        """
+        The canonical query string for a URL on `netloc`
+        """
+        if not query:
+            return ""
+        keep, drop = self.site_rule(netloc)
+        if keep is False:
+            return ""
+        params = []
+        for name, value in parse_qsl(query, keep_blank_values=True):
+            lowered = name.lower()
+            if drop is not None and drop.match(lowered):
+                continue
+            if keep is not None and not keep.match(lowered):
+                continue
+            params.append((name, value))
+        if self.sort:
+            # Stable, so repeated parameters keep their order
+            params.sort(key=lambda param: param[0])
+        return urlencode(params)
+
+
+class DuplicateUrlRules:
+    """
+    URL rewrite rules learned from pages that came back with the same body
+    under two spellings. A pair of URLs on one host that differ only by a
+    trailing slash, an index page name, letter case or one query parameter
+    proposes a rule for that host. The rule is applied once `min_support`
+    pairs agree with it, and dropped for good as soon as it would merge two
+    pages with different bodies. Rules are ("slash", "add" | "strip"),
+    ("index", file name), ("lowercase", "") and ("param", name)
+    """
+
+    index_pages = ("index.html", "index.htm", "index.php", "index.asp", "index.aspx", "default.asp", "default.aspx")
+
+    # Order the rules of a host are applied in, the query first and the trailing slash last
+    kinds = ("param", "lowercase", "index", "slash")
+
+    def __init__(self, min_support=2, rules=()):
+        self.min_support = min_support
+        # {url: body digest} and {body digest: first URL crawled with that body}
+        self.digests = {}
+        self.first = {}
+        # {host: {rule: support}}, with support None once the rule was contradicted
+        self.candidates = {}
+        # {(host, rule): {rewritten URL: body digest}} of the pages crawled so far
+        self.forms = {}
+        # {host: [rule, ...]} of the rules in use, in `kinds` order
+        self.active = {}
+        self.lock = threading.Lock()
+        for host, rule in rules:
+            self.candidates.setdefault(host, {})[rule] = min_support
+            self.forms[host, rule] = {}
+            self.activate(host, rule)
+
+    @staticmethod
+    def digest(html):
+        return hashlib.blake2b(html.encode(errors="replace"), digest_size=16).hexdigest()
+
+    def activate(self, host, rule):
+        rules = self.active.setdefault(host, [])
+        if rule not in rules:
+            rules.append(rule)
+            rules.sort(key=lambda active: self.kinds.index(active[0]))
+
+    def rewrite(self, url):
+        """
+        The URL with the active rules of its host applied
+        """
+        parts = urlparse(url)
+        rules = self.active.get(parts.netloc)
+        if not rules:
+            return url
+        for rule in rules:
+            parts = self.apply(rule, parts)
+        return urlunparse(parts)
+
+    @classmethod
+    def apply(cls, rule, parts):
+        kind, value = rule
+        path = parts.path
+        if kind == "param":
+            query = [(name, v) for name, v in parse_qsl(parts.query, keep_blank_values=True) if name != value]
+            return parts._replace(query=urlencode(query))
+        if kind == "lowercase":
+            return parts._replace(path=path.lower())
+        if kind == "index":
+            return parts._replace(path=path[:-len(value)]) if path.endswith("/" + value) else parts
+        if value == "strip":
+            return parts._replace(path=path.rstrip("/") or "/")
+        # Only paths that look like directories get the slash, /a.html stays as it is
+        last = path.rsplit("/", 1)[-1]
+        return parts._replace(path=path + "/") if last and "." not in last else parts
+
+    def propose(self, url, other):
+        """
+        The rule that would explain `url` and `other` being the same page, None if there is none
+        """
+        a, b = urlparse(url), urlparse(other)
+        if a.netloc != b.netloc or a.scheme != b.scheme:
+            return None
+        if a.path == b.path:
+            first, second = dict(parse_qsl(a.query, keep_blank_values=True)), dict(parse_qsl(b.query, keep_blank_values=True))
+            differing = {name for name in first.keys() | second.keys() if first.get(name) != second.get(name)}
+            return ("param", differing.pop()) if len(differing) == 1 else None
+        if a.query != b.query:
+            return None
+        for shorter, longer in ((a.path, b.path), (b.path, a.path)):
+            for page in self.index_pages:
+                if longer.endswith("/" + page) and longer[:-len(page)] in (shorter, shorter + "/"):
+                    return "index", page
+        if a.path.rstrip("/") == b.path.rstrip("/"):
+            # Rewrite to the spelling that was crawled first
+            return "slash", "add" if b.path.endswith("/") else "strip"
+        if a.path.lower() == b.path.lower():
+            return "lowercase", ""
+        return None
+
+    def check(self, host, rule, url, digest):
+        """
+        Weigh one crawled page against a rule: a page whose rewritten URL is
+        shared with an earlier page with the same body supports it, one with
+        a different body contradicts it
+        """
+        forms = self.forms[host, rule]
+        rewritten = urlunparse(self.apply(rule, urlparse(url)))
+        known = forms.get(rewritten)
+        if known is None:
+            forms[rewritten] = digest
+        elif known == digest:
+            self.candidates[host][rule] += 1
+        else:
+            self.candidates[host][rule] = None
+            del self.forms[host, rule]
+            if rule in self.active.get(host, ()):
+                self.active[host].remove(rule)
+
+    def observe(self, url, digest):
+        """
+        Record the body digest of a crawled page and update the rules of its
+        host. Returns the rules that became active
+        """
+        with self.lock:
+            if url in self.digests:
+                # Crawled again, e.g. a deferred page
+                return []
+            host = urlparse(url).netloc
+            earlier = self.first.setdefault(digest, url)
+            candidates = self.candidates.setdefault(host, {})
+            if earlier != url:
+                rule = self.propose(url, earlier)
+                if rule is not None and rule not in candidates:
+                    # Weigh the new rule against every page of the host crawled so far
+                    candidates[rule] = 0
+                    self.forms[host, rule] = {}
+                    for seen, seen_digest in self.digests.items():
+                        if urlparse(seen).netloc == host and candidates[rule] is not None:
+                            self.check(host, rule, seen, seen_digest)
+            for rule, support in candidates.items():
+                if support is not None:
+                    self.check(host, rule, url, digest)
+            self.digests[url] = digest
+            return self.promote(host, candidates)
+
+    def promote(self, host, rules):
+        promoted = []
+        for rule in rules:
+            support = self.candidates[host][rule]
+            if support is not None and support >= self.min_support and rule not in self.active.get(host, ()):
+                self.activate(host, rule)
+                promoted.append(rule)
+        return promoted
+
+    def rules(self):
+        """
+        (host, rule) of every active rule
+        """
+        return [(host, rule) for host, rules in self.active.items() for rule in rules]
+
+
+class SimHashIndex:
+    """
+    64-bit SimHash fingerprints of a page's text (its words, with numbers
+    folded together) and structure (runs of 4 tags), and an index of the
+    pages crawled so far. Template pages that differ in a few strings and
+    numbers, such as one floorplan page per apartment, end up a few bits
+    apart. The fingerprint is cut into
+    distance + 1 bands, and two fingerprints within `distance` bits must
+    share at least one band, so a lookup only compares the pages filed
+    under the same bands
+    """
+
+    bits = 64
+
+    # Every hash bit gets its own 32-bit lane, so adding up the spread hashes counts all bit positions at once
+    lane = 32
+    spread_bytes = [sum(1 << (32 * bit) for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+    hidden_pattern = re.compile(r"<(script|style)\b.*?</\1\s*>", re.S | re.I)
+    tag_pattern = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)")
+    markup_pattern = re.compile(r"<[^>]*>")
+    word_pattern = re.compile(r"\w+")
+    number_pattern = re.compile(r"\d+")
+
+    def __init__(self, distance=3):
+        self.distance = distance
+        self.band_bits = self.bits // (distance + 1)
+        # One {band value: [(fingerprint, filing order, url), ...]} per band
+        self.bands = [{} for _ in range(distance + 1)]
+        self.filed = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def features(cls, html):
+        tags = [tag.lower() for tag in cls.tag_pattern.findall(html)]
+        text = cls.markup_pattern.sub(" ", cls.hidden_pattern.sub(" ", html)).lower()
+        # Prices, sizes and counts are what template pages differ in, 1500 and 1590 count as the same word
+        words = cls.word_pattern.findall(cls.number_pattern.sub("0", text))
+        features = Counter(">".join(tags[i:i + 4]) for i in range(max(1, len(tags) - 3)))
+        features.update(words)
+        return features
+
+    @classmethod
+    def fingerprint(cls, html):
+        features = cls.features(html)
+        counts = 0
+        for feature, weight in features.items():
+            digest = hashlib.blake2b(feature.encode(errors="replace"), digest_size=8).digest()
+            spread = 0
+            for index, byte in enumerate(digest):
+                spread |= cls.spread_bytes[byte] << (cls.lane * 8 * index)
+            counts += spread * weight
+        # A bit is set when the features with it set outweigh the others
+        half = sum(features.values()) / 2
+        mask = (1 << cls.lane) - 1
+        return sum(1 << bit for bit in range(cls.bits) if (counts >> (cls.lane * bit)) & mask > half)
+
+    def band_keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(fingerprint >> (self.band_bits * band)) & mask for band in range(len(self.bands))]
+
+    def add(self, url, fingerprint):
+        """
+        File the page's fingerprint, returns the earliest page it is a near-duplicate of, or None
+        """
+        with self.lock:
+            keys = self.band_keys(fingerprint)
+            match = None
+            for band, key in zip(self.bands, keys):
+                for other, order, other_url in band.get(key, ()):
+                    if (fingerprint ^ other).bit_count() <= self.distance and (match is None or order < match[0]):
+                        match = (order, other_url)
+            entry = (fingerprint, self.filed, url)
+            self.filed += 1
+            for band, key in zip(self.bands, keys):
+                band.setdefault(key, []).append(entry)
+            return match[1] if match else None
+
+
+class UrlCanonicalizer:
+    """
+    Turns an href found on a page into the normalized internal link to
+    follow, or None, parsing the joined URL once for the join, fragment
+    removal, query canonicalization, scope check and file check. Results are memoized in a
+    bounded LRU keyed by (base, href), where the base is reduced to the part
+    of the page URL the href actually depends on, so a nav menu's "/about"
+    is only resolved once per site instead of once per page
+    """
+
+    # An href with a scheme does not depend on the page, unless it is the
+    # page's scheme without an authority ("http:foo"), see base_key()
+    scheme_pattern = re.compile(r"^([A-Za-z][A-Za-z0-9+.-]*):")
+
+    def __init__(self, scope, file_extensions, maxsize=100_000, query=None):
+        self.scope = scope
+        self.query = query or QueryPolicy()
+        self.file_extensions = tuple(file_extensions)
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # Parser processes start with an empty cache
+        state = self.__dict__.copy()
+        del state["lock"]
+        state["cache"] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def __call__(self, base, href):
+        key = (self.base_key(base, href), href)
+        with self.lock:
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        link = self.canonicalize(base, href)
+        with self.lock:
+            self.misses += 1
+            self.cache[key] = link
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return link
+
+    def base_key(self, base, href):
+        """
+        The part of the page URL that resolving `href` depends on
+        """
+        match = self.scheme_pattern.match(href)
+        if match:
+            rest = href[match.end():]
+            if rest.startswith("//") or match.group(1).lower() != base.partition(":")[0].lower():
+                return None
+            # urljoin() resolves the page's own scheme without an authority like a relative href
+            href = rest
+        if href.startswith("//"):
+            return base.partition(":")[0]
+        scheme, _, rest = base.partition("://")
+        origin = f"{scheme}://{rest.partition('/')[0].partition('?')[0]}"
+        if href.startswith("/"):
+            return origin
+        if not href or href.startswith(("#", "?")):
+            return base
+        # Relative path, resolved against the page's directory, a "/" in the query does not count
+        path = base.partition("?")[0]
+        return path[:path.rfind("/") + 1] if path.count("/") > 2 else origin
+
+    def canonicalize(self, base, href):
+        parsed = urlparse(urljoin(base, href))
+        netloc = parsed.netloc.removeprefix("www.")
+        url = urlunparse((parsed.scheme, netloc, parsed.path, "", self.query.canonical(netloc, parsed.query), ""))
+        if not self.scope.allows(url, netloc, parsed.path) or parsed.path.lower().endswith(self.file_extensions):
+            return None
+        return url
+
+    def report(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return f"URL cache: {lookups} links resolved, {rate:.1%} cache hits, {len(self.cache)} cached"
+
+
+# Returned by the fetchers when a page failed for a reason that may go away
+RETRY_LATER = object()
+
+
+class TotalTimeout(Exception):
+    """
+    Raised when a response takes longer than the total request timeout to download
+    """
+
+
+# Crawler configuration copied into each parser process
+_parser = None
+
+
+def _init_parser(attributes):
+    global _parser
+    _parser = WebCrawler.__new__(WebCrawler)
+    _parser.__dict__.update(attributes)
+
+
+def _parse_links(url, html):
+    return _parser.extract_links(url, html)
+
+
+class Frontier:
+    """
+    Queue of URLs waiting to be crawled, shallowest depth first and FIFO within
+    a depth. A URL is only queued the first time it is seen, so pages linked
+    from a shared nav menu are fetched once. The crawl budgets live here too:
+    URLs deeper than `max_depth` or beyond `max_pages` discovered pages are
+    refused, and the frontier reports itself empty once `max_duration` seconds
+    have passed since the first pop
+    """
+
+    def __init__(self, urls=(), seen=None, max_pages=None, max_depth=None, max_duration=None):
+        # One FIFO queue per depth
+        self.levels = {}
+        self.pending = 0
+        self.seen = set() if seen is None else seen
+        self.accepted = 0
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.max_duration = max_duration
+        self.deadline = None
+        for url in urls:
+            self.add(url)
+
+    def add(self, url, depth=0):
+        """
+        Queue the URL if it has not been seen before and fits the budgets,
+        return True if it was queued
+        """
+        if url in self.seen or not self.admits(depth):
+            return False
+        self.seen.add(url)
+        self.accepted += 1
+        self.levels.setdefault(depth, deque()).append(url)
+        self.pending += 1
+        return True
+
+    def admits(self, depth):
+        """
+        Check if a new URL at `depth` fits the budgets, without queueing it
+        """
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        return self.max_pages is None or self.accepted < self.max_pages
+
+    def pop(self):
+        """
+        Take the next URL to crawl
+        """
+        self.start_clock()
+        depth = min(self.levels)
+        level = self.levels[depth]
+        url = level.popleft()
+        if not level:
+            del self.levels[depth]
+        self.pending -= 1
+        return url
+
+    def pending_urls(self):
+        """
+        URLs still queued, in the order they would be popped
+        """
+        return [url for depth in sorted(self.levels) for url in self.levels[depth]]
+
+    def mark_seen(self, url):
+        """
+        Remember the URL without queueing it, e.g. when it was crawled by a previous run
+        """
+        if url not in self.seen:
+            self.seen.add(url)
+            self.accepted += 1
+
+    def requeue(self, url, depth=0):
+        """
+        Queue an already seen URL again, e.g. to retry it after a transient failure
+        """
+        self.levels.setdefault(depth, deque()).append(url)
+        self.pending += 1
+
+    def note_link(self, url):
+        """
+        Called for every internal link to a URL that has not been visited yet
+        """
+
+    def start_clock(self):
+        """
+        Start the max_duration countdown, the first pop does it for the crawl loops
+        """
+        if self.deadline is None and self.max_duration is not None:
+            self.deadline = time.monotonic() + self.max_duration
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remaining(self):
+        """
+        Seconds left before the crawl deadline, None without one
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def __contains__(self, url):
+        return url in self.seen
+
+    def __len__(self):
+        # Number of URLs still pending
+        return self.pending
+
+    def has_pending(self):
+        """
+        Check if URLs are waiting, whether or not the deadline has passed
+        """
+        return self.pending > 0
+
+    def __bool__(self):
+        return self.has_pending() and not self.expired()
+
+
+def url_pattern(url):
+    """
+    Pattern shared by sibling pages, e.g. /floorplan/* for /floorplan/s1 and
+    /floorplan/a2, with numbers in the directories replaced by #
+    """
+    directory, _, last = urlparse(url).path.rstrip("/").rpartition("/")
+    if not last:
+        return "/"
+    return re.sub(r"\d+", "#", directory) + "/*"
+
+
+def depth_scorer(url, depth, frontier):
+    """
+    Prefer pages close to the domain URL
+    """
+    return -depth
+
+
+def inlink_scorer(url, depth, frontier):
+    """
+    Prefer pages many crawled pages link to
+    """
+    return math.log1p(frontier.in_links.get(url, 0))
+
+
+def novelty_scorer(url, depth, frontier):
+    """
+    Prefer pages whose URL pattern has few siblings discovered so far
+    """
+    return 1 / frontier.pattern_counts.get(url_pattern(url), 1)
+
+
+class SitemapPriorityScorer:
+    """
+    Prefer pages with a high <priority> in sitemap.xml
+    """
+
+    def __init__(self, priorities=None, default=0.5):
+        self.priorities = priorities
+        self.default = default
+
+    def prepare(self, crawler):
+        if self.priorities is None:
+            self.priorities = crawler.load_sitemap_priorities()
+
+    def __call__(self, url, depth, frontier):
+        return (self.priorities or {}).get(url, self.default)
+
+
+class WeightedScorer:
+    """
+    Weighted sum of several scorers
+    """
+
+    # Scorers selectable by name from the command line
+    builtin = {
+        "depth": depth_scorer,
+        "inlinks": inlink_scorer,
+        "novelty": novelty_scorer,
+        "sitemap": SitemapPriorityScorer,
+    }
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Build from "name:weight,name:weight", e.g. "depth:1,novelty:2"
+        """
+        parts = []
+        for item in spec.split(","):
+            name, _, weight = item.strip().partition(":")
+            scorer = cls.builtin[name]
+            if isinstance(scorer, type):
+                scorer = scorer()
+            parts.append((scorer, float(weight or 1)))
+        return cls(parts)
+
+    def prepare(self, crawler):
+        for scorer, _ in self.parts:
+            if hasattr(scorer, "prepare"):
+                scorer.prepare(crawler)
+
+    def __call__(self, url, depth, frontier):
+        return sum(weight * scorer(url, depth, frontier) for scorer, weight in self.parts)
+
+
+class BestFirstFrontier(Frontier):
+    """
+    Frontier popping the URL with the highest score first, ties in FIFO order.
+    `scorer(url, depth, frontier)` may depend on what has been discovered
+    since the URL was queued: a new in-link re-scores the URL straight away,
+    and a popped URL whose score has dropped is re-queued with the new score.
+    Here `max_pages` limits the pages crawled instead of the pages discovered,
+    so the budget goes to the best pages found so far
+    """
+
+    def __init__(self, urls=(), seen=None, scorer=depth_scorer, **budgets):
+        self.scorer = scorer
+        self.heap = []
+        # Current score of each pending URL, older heap entries are stale
+        self.scores = {}
+        self.depths = {}
+        self.in_links = {}
+        self.pattern_counts = {}
+        self.counter = itertools.count()
+        self.popped = 0
+        super().__init__(urls, seen, **budgets)
+
+    def add(self, url, depth=0):
+        if url in self.seen or not self.admits(depth):
+            return False
+        self.seen.add(url)
+        self.accepted += 1
+        pattern = url_pattern(url)
+        self.pattern_counts[pattern] = self.pattern_counts.get(pattern, 0) + 1
+        self.depths[url] = depth
+        self.push(url)
+        self.pending += 1
+        return True
+
+    def admits(self, depth):
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        return self.max_pages is None or self.popped < self.max_pages
+
+    def requeue(self, url, depth=0):
+        self.depths[url] = depth
+        self.push(url)
+        self.pending += 1
+
+    def push(self, url):
+        score = self.scorer(url, self.depths[url], self)
+        self.scores[url] = score
+        heapq.heappush(self.heap, (-score, next(self.counter), url))
+
+    def note_link(self, url):
+        self.in_links[url] = self.in_links.get(url, 0) + 1
+        if url in self.scores:
+            self.push(url)
+
+    def pop(self):
+        self.start_clock()
+        while True:
+            negative_score, _, url = heapq.heappop(self.heap)
+            if self.scores.get(url) != -negative_score:
+                continue
+            score = self.scorer(url, self.depths[url], self)
+            if score < -negative_score:
+                self.scores[url] = score
+                heapq.heappush(self.heap, (-score, next(self.counter), url))
+                continue
+            del self.scores[url]
+            del self.depths[url]
+            self.pending -= 1
+            self.popped += 1
+            return url
+
+    def pending_urls(self):
+        urls = {}
+        for negative_score, _, url in sorted(self.heap):
+            if self.scores.get(url) == -negative_score:
+                urls[url] = None
+        return list(urls)
+
+    def has_pending(self):
+        if self.max_pages is not None and self.popped >= self.max_pages:
+            return False
+        return self.pending > 0
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter, sized for `capacity` items at `error_rate` false positives
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+class CompactUrlSet:
+    """
+    Set of URLs held as a Bloom filter in memory and exactly in a SQLite file.
+    Most lookups of new URLs are answered by the filter alone, a filter hit is
+    confirmed on disk so a false positive never drops a URL. Memory stays at
+    the filter size however many URLs are added. Lookups may come from the
+    fetching threads, see WebCrawler.check_redirect()
+    """
+
+    # Adds between commits of the on-disk set
+    commit_every = 1000
+
+    def __init__(self, path, capacity=1_000_000, error_rate=0.01):
+        self.path = path
+        self.filter = BloomFilter(capacity, error_rate)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute("DROP TABLE IF EXISTS urls")
+        self.connection.execute("CREATE TABLE urls (url TEXT PRIMARY KEY)")
+        self.count = 0
+        self.uncommitted = 0
+
+    def add(self, url):
+        if url in self:
+            return
+        with self.lock:
+            self.filter.add(url)
+            self.connection.execute("INSERT INTO urls (url) VALUES (?)", (url,))
+            self.count += 1
+            self.uncommitted += 1
+            if self.uncommitted >= self.commit_every:
+                self.connection.commit()
+                self.uncommitted = 0
+
+    def discard(self, url):
+        # The filter keeps the URL's bits, the on-disk set no longer confirms it
+        if url not in self:
+            return
+        with self.lock:
+            self.connection.execute("DELETE FROM urls WHERE url = ?", (url,))
+            self.count -= 1
+
+    def update(self, urls):
+        for url in urls:
+            self.add(url)
+
+    def __contains__(self, url):
+        if url not in self.filter:
+            return False
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM urls WHERE url = ?", (url,)).fetchone() is not None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        with self.lock:
+            urls = self.connection.execute("SELECT url FROM urls").fetchall()
+        for (url,) in urls:
+            yield url
+
+    def close(self):
+        self.connection.close()
+
+
+class CrawlStore:
+    """
+    SQLite file holding the state of a crawl so an interrupted crawl can be
+    resumed. Nodes are stored in the order they were created, which is also
+    the order they were queued, so the hierarchy and the frontier can both be
+    rebuilt from them
+    """
+
+    def __init__(self, path, crawl_id, checkpoint_every=50, checkpoint_seconds=30):
+        self.path = path
+        self.crawl_id = crawl_id
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_seconds = checkpoint_seconds
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS crawls (
+                crawl_id TEXT PRIMARY KEY,
+                base_url TEXT NOT NULL,
+                started REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS nodes (
+                crawl_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                parent TEXT,
+                internal INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'pending',
+                PRIMARY KEY (crawl_id, url)
+            );
+        """)
+        row = self.connection.execute("SELECT MAX(seq) FROM nodes WHERE crawl_id = ?", (crawl_id,)).fetchone()
+        self.next_seq = 0 if row[0] is None else row[0] + 1
+        # Writes waiting for the next checkpoint
+        self.pending = []
+        self.pages_since_checkpoint = 0
+        self.last_checkpoint = time.monotonic()
+
+    def base_url(self):
+        """
+        Base URL of the stored crawl, None if there is no such crawl
+        """
+        row = self.connection.execute("SELECT base_url FROM crawls WHERE crawl_id = ?", (self.crawl_id,)).fetchone()
+        return row[0] if row else None
+
+    def start(self, base_url):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO crawls (crawl_id, base_url, started) VALUES (?, ?, ?)",
+                (self.crawl_id, base_url, time.time()),
+            )
+
+    def add_node(self, url, parent):
+        self.pending.append((
+            "INSERT OR IGNORE INTO nodes (crawl_id, seq, url, parent) VALUES (?, ?, ?, ?)",
+            (self.crawl_id, self.next_seq, url, parent),
+        ))
+        self.next_seq += 1
+
+    def mark_internal(self, url):
+        self.pending.append(("UPDATE nodes SET internal = 1 WHERE crawl_id = ? AND url = ?", (self.crawl_id, url)))
+
+    def set_status(self, url, status):
+        self.pending.append(("UPDATE nodes SET status = ? WHERE crawl_id = ? AND url = ?", (status, self.crawl_id, url)))
+
+    def rename(self, url, new_url):
+        self.pending.append(("UPDATE nodes SET url = ? WHERE crawl_id = ? AND url = ?", (new_url, self.crawl_id, url)))
+
+    def load(self):
+        """
+        Stored nodes as (url, parent, internal, status) in the order they were created
+        """
+        return self.connection.execute(
+            "SELECT url, parent, internal, status FROM nodes WHERE crawl_id = ? ORDER BY seq",
+            (self.crawl_id,),
+        ).fetchall()
+
+    def page_done(self):
+        """
+        Count a finished page and checkpoint every `checkpoint_every` pages or `checkpoint_seconds`
+        """
+        self.pages_since_checkpoint += 1
+        if (
+                self.pages_since_checkpoint >= self.checkpoint_every
+                or time.monotonic() - self.last_checkpoint >= self.checkpoint_seconds
+        ):
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Write the buffered changes in one transaction
+        """
+        with self.connection:
+            for statement, params in self.pending:
+                self.connection.execute(statement, params)
+        self.pending = []
+        self.pages_since_checkpoint = 0
+        self.last_checkpoint = time.monotonic()
+
+    def close(self):
+        self.checkpoint()
+        self.connection.close()
+
+
+class HttpCache:
+    """
+    Validators, body and links of each fetched page, kept in SQLite across
+    runs. Pages are requested with If-None-Match / If-Modified-Since, and a 304
+    reuses the stored body and links instead of downloading and parsing again
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Used from the fetch threads, every access goes through the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    body TEXT NOT NULL,
+                    links TEXT,
+                    fetch_seconds REAL NOT NULL
+                )
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS redirects (
+                    source TEXT PRIMARY KEY,
+                    final TEXT NOT NULL
+                )
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS duplicate_rules (
+                    host TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (host, kind, value)
+                )
+            """)
+            columns = {row[1] for row in self.connection.execute("PRAGMA table_info(responses)")}
+            if "lastmod" not in columns:
+                # Sitemap <lastmod> of the page when it was fetched
+                self.connection.execute("ALTER TABLE responses ADD COLUMN lastmod TEXT")
+            if "links_key" not in columns:
+                # Scope and canonicalization settings the links were extracted with
+                self.connection.execute("ALTER TABLE responses ADD COLUMN links_key TEXT")
+        # Pages answered with 304 during this run
+        self.not_modified = set()
+        self.bytes_saved = 0
+        self.seconds_saved = 0.0
+
+    def validators(self, url):
+        """
+        Conditional request headers for the URL, empty if it was never cached
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT etag, last_modified FROM responses WHERE url = ?", (url,)).fetchone()
+        headers = {}
+        if row and row[0]:
+            headers["If-None-Match"] = row[0]
+        if row and row[1]:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def store(self, url, headers, body, seconds, lastmod=None):
+        """
+        Remember a 200 response that carries an ETag or Last-Modified, or is
+        listed in the sitemap with a <lastmod>
+        """
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified and not lastmod:
+            return
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (url, etag, last_modified, body, links, fetch_seconds, lastmod) "
+                "VALUES (?, ?, ?, ?, NULL, ?, ?)",
+                (url, etag, last_modified, body, seconds, lastmod.isoformat() if lastmod else None),
+            )
+
+    def unchanged(self, url, lastmod):
+        """
+        Stored body of a page whose sitemap <lastmod> is not newer than when
+        it was fetched, None if it has to be fetched again
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT body, fetch_seconds, lastmod FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None or row[2] is None or lastmod > datetime.fromisoformat(row[2]):
+                return None
+            self.not_modified.add(url)
+            self.bytes_saved += len(row[0].encode())
+            self.seconds_saved += row[1]
+        return row[0]
+
+    def reuse(self, url, seconds):
+        """
+        Stored body after a 304 answer that took `seconds`, None if nothing is stored
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT body, fetch_seconds FROM responses WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            self.not_modified.add(url)
+            self.bytes_saved += len(row[0].encode())
+            self.seconds_saved += max(0.0, row[1] - seconds)
+        return row[0]
+
+    def links(self, url, key):
+        """
+        Stored links of a page that was not modified, None if they have to be
+        extracted, also when they were extracted with other settings than `key`
+        """
+        if url not in self.not_modified:
+            return None
+        with self.lock:
+            row = self.connection.execute("SELECT links, links_key FROM responses WHERE url = ?", (url,)).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None and row[1] == key else None
+
+    def store_links(self, url, links, key):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE responses SET links = ?, links_key = ? WHERE url = ?", (json.dumps(links), key, url)
+            )
+
+    def redirects(self):
+        """
+        Source to final URL of the redirects seen by earlier runs
+        """
+        with self.lock:
+            return dict(self.connection.execute("SELECT source, final FROM redirects"))
+
+    def store_redirect(self, source, final):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO redirects (source, final) VALUES (?, ?)", (source, final))
+
+    def duplicate_rules(self):
+        """
+        (host, rule) of the duplicate URL rules learned by earlier runs, see DuplicateUrlRules
+        """
+        with self.lock:
+            return [(host, (kind, value)) for host, kind, value in
+                    self.connection.execute("SELECT host, kind, value FROM duplicate_rules")]
+
+    def store_duplicate_rules(self, rules):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM duplicate_rules")
+            self.connection.executemany(
+                "INSERT INTO duplicate_rules (host, kind, value) VALUES (?, ?, ?)",
+                [(host, kind, value) for host, (kind, value) in rules],
+            )
+
+    def report(self):
+        return (
+            f"HTTP cache: {len(self.not_modified)} pages not modified, "
+            f"saved {self.bytes_saved} bytes and {self.seconds_saved:.1f}s"
+        )
+
+    def close(self):
+        self.connection.close()
+
+
+class ResponseArchive:
+    """
+    Append-only archive of HTTP responses in WARC-style records, one gzip
+    member per record in responses.warc.gz, with index.jsonl mapping each URL
+    to its latest record
+    """
+
+    # Headers that describe the transfer rather than the stored body
+    transfer_headers = {"content-encoding", "content-length", "transfer-encoding"}
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.archive_path = os.path.join(directory, "responses.warc.gz")
+        self.index_path = os.path.join(directory, "index.jsonl")
+        self.lock = threading.Lock()
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as index_file:
+                for line in index_file:
+                    entry = json.loads(line)
+                    self.index[entry["url"]] = (entry["offset"], entry["length"])
+
+    def write(self, url, status, reason, headers, body):
+        http_block = f"HTTP/1.1 {status} {reason}\r\n".encode("latin-1")
+        for name, value in headers.items():
+            if name.lower() not in self.transfer_headers:
+                http_block += f"{name}: {value}\r\n".encode("latin-1", "replace")
+        http_block += b"\r\n" + body
+        warc_headers = (
+            "WARC/1.0\r\n"
+            "WARC-Type: response\r\n"
+            f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n"
+            f"WARC-Date: {datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}\r\n"
+            f"WARC-Target-URI: {url}\r\n"
+            "Content-Type: application/http; msgtype=response\r\n"
+            f"Content-Length: {len(http_block)}\r\n\r\n"
+        )
+        record = gzip.compress(warc_headers.encode() + http_block + b"\r\n\r\n")
+
+        with self.lock:
+            with open(self.archive_path, "ab") as archive_file:
+                offset = archive_file.tell()
+                archive_file.write(record)
+            with open(self.index_path, "a") as index_file:
+                index_file.write(json.dumps({"url": url, "offset": offset, "length": len(record)}) + "\n")
+            self.index[url] = (offset, len(record))
+
+    def read(self, url):
+        """
+        (status, reason, headers, body) of the latest record for the URL, None if not archived
+        """
+        if url not in self.index:
+            return None
+        offset, length = self.index[url]
+        with open(self.archive_path, "rb") as archive_file:
+            archive_file.seek(offset)
+            record = gzip.decompress(archive_file.read(length))
+
+        warc_headers, _, rest = record.partition(b"\r\n\r\n")
+        content_length = int(re.search(rb"Content-Length: (\d+)", warc_headers).group(1))
+        head, _, body = rest[:content_length].partition(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        _, status, reason = (status_line.split(" ", 2) + [""])[:3]
+        headers = dict(line.split(": ", 1) for line in header_lines)
+        return int(status), reason, headers, body
+
+
+class TeeRaw:
+    """
+    Wraps the raw stream of a response and hands the body to `on_done` as
+    the crawler reads it, so recording does not download the page up front.
+    A body that was only partly read (too large, timed out) is not handed
+    over, a response closed before any of it was read is, with an empty body
+    """
+
+    def __init__(self, raw, on_done):
+        self.raw = raw
+        self.on_done = on_done
+        self.body = bytearray()
+        self.done = False
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def capture(self, data, complete=False):
+        self.body += data
+        if complete or not data:
+            self.finish(True)
+        return data
+
+    def read(self, amt=None, *args, **kwargs):
+        return self.capture(self.raw.read(amt, *args, **kwargs), amt is None)
+
+    def read1(self, *args, **kwargs):
+        return self.capture(self.raw.read1(*args, **kwargs))
+
+    def stream(self, *args, **kwargs):
+        for chunk in self.raw.stream(*args, **kwargs):
+            self.body += chunk
+            yield chunk
+        self.finish(True)
+
+    def close(self):
+        self.finish(False)
+        self.raw.close()
+
+    def finish(self, complete):
+        if self.done:
+            return
+        self.done = True
+        if complete or not self.body:
+            self.on_done(bytes(self.body))
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    Transport adapter writing every response it receives to a ResponseArchive
+    """
+
+    def __init__(self, archive, **kwargs):
+        super().__init__(**kwargs)
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+
+        def write(body):
+            self.archive.write(request.url, response.status_code, response.reason, response.headers, body)
+
+        # The record is written once the crawler has read the body, see TeeRaw
+        response.raw = TeeRaw(response.raw, write)
+        return response
+
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    Transport adapter answering from a ResponseArchive without touching the
+    network, URLs missing from the archive get a 404
+    """
+
+    def __init__(self, archive, **kwargs):
+        super().__init__(**kwargs)
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        record = self.archive.read(request.url)
+        if record is None:
+            record = (404, "Not In Archive", {}, b"")
+        status, reason, headers, body = record
+        raw = HTTPResponse(
+            body=io.BytesIO(body), headers=headers, status=status, reason=reason, preload_content=False
+        )
+        return self.build_response(request, raw)
+
+
+class FetchBackend:
+    """
+    Base class of the fetch backends, counting requests, connections and TLS handshakes
+    """
+
+    def __init__(self):
+        self.stats = Counter()
+        self.lock = threading.Lock()
+
+    def configure(self, session, archive=None, replay=False):
+        pass
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def connection_stats(self):
+        with self.lock:
+            return Counter(self.stats)
+
+
+class RequestsBackend(FetchBackend):
+    """
+    Fetch backend on requests sessions. Each session keeps up to
+    `pool_connections` host pools of `pool_maxsize` keep-alive connections
+    """
+
+    name = "requests"
+    errors = (requests.RequestException, Urllib3Error)
+
+    def __init__(self, pool_connections=10, pool_maxsize=10):
+        super().__init__()
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_classes = self.counting_pool_classes()
+
+    def counting_pool_classes(self):
+        """
+        urllib3 pool classes reporting every request and every (re)connect of
+        their connections to this backend, redirect hops and robots.txt or
+        sitemap fetches included
+        """
+        backend = self
+
+        class CountingPool:
+            def urlopen(self, *args, **kwargs):
+                backend.count("requests")
+                return super().urlopen(*args, **kwargs)
+
+        class CountingHTTPConnection(HTTPConnection):
+            def connect(self):
+                super().connect()
+                backend.count("connections")
+
+        class CountingHTTPSConnection(HTTPSConnection):
+            def connect(self):
+                super().connect()
+                backend.count("connections")
+                backend.count("tls_handshakes")
+
+        class CountingHTTPConnectionPool(CountingPool, HTTPConnectionPool):
+            ConnectionCls = CountingHTTPConnection
+
+        class CountingHTTPSConnectionPool(CountingPool, HTTPSConnectionPool):
+            ConnectionCls = CountingHTTPSConnection
+
+        return {"http": CountingHTTPConnectionPool, "https": CountingHTTPSConnectionPool}
+
+    def configure(self, session, archive=None, replay=False):
+        """
+        Mount the tuned adapter, recording to or replaying from `archive` if given
+        """
+        pool = {"pool_connections": self.pool_connections, "pool_maxsize": self.pool_maxsize}
+        if archive and replay:
+            adapter = ReplayAdapter(archive, **pool)
+        elif archive:
+            adapter = RecordingAdapter(archive, **pool)
+        else:
+            adapter = HTTPAdapter(**pool)
+        adapter.poolmanager.pool_classes_by_scheme = self.pool_classes
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+    def new_session(self, crawler):
+        session = requests.Session()
+        session.headers.update(crawler.session.headers)
+        session.cookies.update(crawler.session.cookies)
+        self.configure(session, crawler.archive, crawler.replay)
+        return session
+
+    def main_session(self, crawler):
+        return crawler.session
+
+    def stream(self, session, url, headers, timeout=None, on_redirect=None):
+        """
+        Start a streamed GET, `timeout` is a (connect, read) pair of seconds
+        and on_redirect(url, location) is called before following a redirect
+        """
+        hooks = {}
+        if on_redirect:
+            def check(response, *args, **kwargs):
+                if response.is_redirect:
+                    on_redirect(response.url, response.headers["Location"])
+            hooks["response"] = [check]
+        return session.get(url, headers=headers, stream=True, timeout=timeout, hooks=hooks)
+
+    def iter_chunks(self, response, chunk_size):
+        if response._content_consumed:
+            # Already read, e.g. by a hook, the raw stream is empty
+            yield from response.iter_content(chunk_size)
+            return
+        # read1() returns whatever has arrived instead of waiting for a full
+        # chunk, so the total timeout is checked while a slow server trickles
+        while True:
+            chunk = response.raw.read1(chunk_size, decode_content=True)
+            if not chunk:
+                break
+            yield chunk
+
+
+class HttpxBackend(FetchBackend):
+    """
+    Fetch backend on one shared httpx client, optionally over HTTP/2 so the
+    workers multiplex their requests over a single connection per host
+    """
+
+    name = "httpx"
+
+    def __init__(self, http2=True, max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0):
+        super().__init__()
+        # Imported here, only crawls with --http2 load httpx
+        import httpx
+        self.errors = (httpx.HTTPError,)
+        self.http2 = http2
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.client = None
+        self.local = threading.local()
+
+    def new_session(self, crawler):
+        import httpx
+        # httpx clients are thread safe, all workers share the connections
+        with self.lock:
+            if self.client is None:
+                self.client = httpx.Client(
+                    http2=self.http2,
+                    limits=self.limits,
+                    headers=dict(crawler.session.headers),
+                    cookies=crawler.session.cookies,
+                    event_hooks={"response": [self.check_redirect]},
+                )
+        return self.client
+
+    def check_redirect(self, response):
+        # httpx has no per request hooks, the on_redirect of the current stream() is kept per thread
+        on_redirect = getattr(self.local, "on_redirect", None)
+        if on_redirect and response.is_redirect:
+            on_redirect(str(response.url), response.headers["Location"])
+
+    def main_session(self, crawler):
+        return self.new_session(crawler)
+
+    def trace(self, event_name, info):
+        # Traced per request sent, so redirect hops are counted like in RequestsBackend
+        if event_name in ("http11.send_request_headers.complete", "http2.send_request_headers.complete"):
+            self.count("requests")
+        elif event_name == "connection.connect_tcp.complete":
+            self.count("connections")
+        elif event_name == "connection.start_tls.complete":
+            self.count("tls_handshakes")
+
+    def stream(self, session, url, headers, timeout=None, on_redirect=None):
+        import httpx
+        self.local.on_redirect = on_redirect
+        connect, read = timeout or (None, None)
+        return session.stream(
+            "GET", url, headers=headers, follow_redirects=True,
+            timeout=httpx.Timeout(read, connect=connect), extensions={"trace": self.trace},
+        )
+
+    def iter_chunks(self, response, chunk_size):
+        # Yield bytes as they arrive, see RequestsBackend.iter_chunks()
+        return response.iter_bytes()
+
+
+class HostCircuit:
+    """
+    Failure bookkeeping for one host
+    """
+
+    def __init__(self, cooldown):
+        self.failures = 0
+        self.cooldown = cooldown
+        self.open_until = None
+        self.trial = False
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker. After `threshold` consecutive failures a host is
+    not requested for `cooldown` seconds, then a single trial request either
+    closes the circuit or keeps it open for twice as long
+    """
+
+    def __init__(self, threshold=5, cooldown=30.0, max_cooldown=600.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.circuits = {}
+        self.lock = threading.Lock()
+
+    def allow(self, url):
+        """
+        Check if the URL's host may be requested now
+        """
+        with self.lock:
+            circuit = self.circuits.get(urlparse(url).netloc)
+            if circuit is None or circuit.open_until is None:
+                return True
+            if time.monotonic() < circuit.open_until or circuit.trial:
+                return False
+            # Half open, let one request through
+            circuit.trial = True
+            return True
+
+    def success(self, url):
+        with self.lock:
+            circuit = self.circuits.get(urlparse(url).netloc)
+            if circuit:
+                circuit.failures = 0
+                circuit.cooldown = self.cooldown
+                circuit.open_until = None
+                circuit.trial = False
+
+    def failure(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            circuit = self.circuits.setdefault(host, HostCircuit(self.cooldown))
+            circuit.failures += 1
+            if circuit.trial:
+                circuit.trial = False
+                circuit.cooldown = min(self.max_cooldown, circuit.cooldown * 2)
+                circuit.open_until = time.monotonic() + circuit.cooldown
+            elif circuit.open_until is None and circuit.failures >= self.threshold:
+                circuit.open_until = time.monotonic() + circuit.cooldown
+                print(f"{host} failed {circuit.failures} times in a row, pausing it for {circuit.cooldown:g}s")
+
+    def wait_time(self, urls):
+        """
+        Seconds until at least one of the URLs' hosts may be requested again
+        """
+        now = time.monotonic()
+        waits = []
+        with self.lock:
+            for url in urls:
+                circuit = self.circuits.get(urlparse(url).netloc)
+                if circuit is None or circuit.open_until is None:
+                    return 0.0
+                waits.append(max(0.0, circuit.open_until - now))
+        return min(waits, default=0.0)
+
+
+class HostState:
+    """
+    Rate, concurrency and latency bookkeeping for one host
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        # Upper bound from the host's robots.txt Crawl-delay
+        self.max_rate = None
+        self.updated = time.monotonic()
+        self.concurrency = 1.0
+        self.in_flight = 0
+        # Doubling every window until the first backoff or latency rise
+        self.slow_start = True
+        # Good responses since the rate and concurrency were last raised
+        self.window_responses = 0
+        self.latency = None
+        self.base_latency = None
+        self.blocked_until = 0.0
+
+
+class PolitenessScheduler:
+    """
+    Per-host token bucket rate limit with AIMD concurrency. A 429/503 or a
+    Retry-After halves the host's rate and concurrency. While the latency
+    stays close to the best seen they are raised once per window of
+    `concurrency` responses: doubled until the first backoff or latency
+    rise, like TCP slow start, then by one request per window
+    """
+
+    # Status codes that mean the host wants us to slow down
+    backoff_statuses = {429, 503}
+
+    def __init__(self, rate=5.0, max_rate=50.0, min_rate=0.2, burst=2, max_concurrency=16, max_retry_after=300.0):
+        self.start_rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        # Longest Retry-After honoured, a host asking for an hour is paused this long instead
+        self.max_retry_after = max_retry_after
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def host_state(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = HostState(self.start_rate, self.burst)
+        return self.hosts[host]
+
+    def try_acquire(self, url):
+        """
+        Take a slot for the URL's host, return 0 on success or the seconds to
+        wait before trying again
+        """
+        with self.lock:
+            state = self.host_state(urlparse(url).netloc)
+            now = time.monotonic()
+            state.tokens = min(state.burst, state.tokens + (now - state.updated) * state.rate)
+            state.updated = now
+            if now < state.blocked_until:
+                return state.blocked_until - now
+            if state.in_flight >= int(state.concurrency):
+                return 0.05
+            if state.tokens < 1:
+                return (1 - state.tokens) / state.rate
+            state.tokens -= 1
+            state.in_flight += 1
+            return 0
+
+    def acquire(self, url, remaining=None):
+        """
+        Wait for a slot for the URL's host. False, without a slot, when the
+        wait would run past the `remaining()` seconds left in the crawl
+        """
+        while True:
+            wait = self.try_acquire(url)
+            if not wait:
+                return True
+            left = remaining() if remaining else None
+            if left is not None and wait >= left:
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, url, remaining=None):
+        while True:
+            wait = self.try_acquire(url)
+            if not wait:
+                return True
+            left = remaining() if remaining else None
+            if left is not None and wait >= left:
+                return False
+            await asyncio.sleep(wait)
+
+    def release(self, url, status, latency, retry_after=None):
+        """
+        Give the slot back and adapt the host's rate and concurrency to the response
+        """
+        with self.lock:
+            state = self.host_state(urlparse(url).netloc)
+            state.in_flight -= 1
+            if status in self.backoff_statuses or retry_after:
+                # Multiplicative decrease
+                state.rate = min(max(self.min_rate, state.rate / 2), state.max_rate or self.max_rate)
+                state.concurrency = max(1.0, state.concurrency / 2)
+                state.tokens = min(state.tokens, 0)
+                state.slow_start = False
+                state.window_responses = 0
+                if retry_after:
+                    retry_after = min(retry_after, self.max_retry_after)
+                    state.blocked_until = max(state.blocked_until, time.monotonic() + retry_after)
+                return
+            if status is None:
+                return
+
+            state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+            if state.base_latency is None or state.latency < state.base_latency:
+                state.base_latency = state.latency
+            if state.latency > 2 * state.base_latency:
+                # The host is falling behind, stop ramping up
+                state.slow_start = False
+                state.window_responses = 0
+                return
+            state.window_responses += 1
+            if state.window_responses < int(state.concurrency):
+                return
+            state.window_responses = 0
+            # The rate grows with the concurrency so the tokens keep up with the requests in flight
+            concurrency = min(self.max_concurrency, 2 * state.concurrency if state.slow_start else state.concurrency + 1)
+            state.rate = min(state.max_rate or self.max_rate, state.rate * concurrency / state.concurrency)
+            state.concurrency = concurrency
+
+    def set_crawl_delay(self, host, delay):
+        """
+        Never request the host more often than once every `delay` seconds
+        """
+        with self.lock:
+            state = self.host_state(host)
+            state.max_rate = 1 / delay
+            state.rate = min(state.rate, state.max_rate)
+            state.burst = 1
+            state.tokens = min(state.tokens, 1)
+
+    @staticmethod
+    def parse_retry_after(value):
+        """
+        Seconds to wait from a Retry-After header (delay-seconds or HTTP date)
+        """
+        if not value:
+            return None
+        if value.strip().isdigit():
+            return float(value)
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RobotsCache:
+    """
+    robots.txt rules of each host, fetched the first time a URL on the host
+    is checked. A Crawl-delay is handed to the politeness scheduler
+    """
+
+    def __init__(self, fetch, user_agent="*", scheduler=None):
+        # fetch(url) returns (status, text), (None, None) if the request failed
+        self.fetch = fetch
+        self.user_agent = user_agent
+        self.scheduler = scheduler
+        self.parsers = {}
+        self.lock = threading.Lock()
+
+    def parser(self, url):
+        parts = urlparse(url)
+        with self.lock:
+            if parts.netloc not in self.parsers:
+                robots_url = f"{parts.scheme}://{parts.netloc}/robots.txt"
+                status, text = self.fetch(robots_url)
+                parser = RobotFileParser(robots_url)
+                if status in (401, 403):
+                    parser.disallow_all = True
+                elif status == 200:
+                    parser.parse(text.splitlines())
+                else:
+                    # No robots.txt, or the host could not be reached
+                    parser.allow_all = True
+                delay = parser.crawl_delay(self.user_agent)
+                if delay and self.scheduler:
+                    self.scheduler.set_crawl_delay(parts.netloc, float(delay))
+                self.parsers[parts.netloc] = parser
+            return self.parsers[parts.netloc]
+
+    def allowed(self, url):
+        return self.parser(url).can_fetch(self.user_agent, url)
+
+    def sitemaps(self, url):
+        """
+        Sitemap URLs listed in the robots.txt of the URL's host
+        """
+        return self.parser(url).site_maps() or []
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping each URL to the worker that owns it
+    """
+
+    def __init__(self, worker_ids, replicas=64):
+        self.ring = sorted((self.hash(f"{worker_id}#{i}"), worker_id) for worker_id in worker_ids for i in range(replicas))
+        self.keys = [key for key, _ in self.ring]
+
+    @staticmethod
+    def hash(value):
+        return int(hashlib.md5(value.encode()).hexdigest()[:16], 16)
+
+    def owner(self, url):
+        index = bisect.bisect(self.keys, self.hash(url)) % len(self.keys)
+        return self.ring[index][1]
+
+
+class LocalQueueBackend:
+    """
+    In-process queues, for workers running as threads of the coordinator
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.lock = threading.Lock()
+
+    def get_queue(self, name):
+        with self.lock:
+            return self.queues.setdefault(name, queue.Queue())
+
+    def put(self, name, message):
+        self.get_queue(name).put(message)
+
+    def get(self, name, timeout=1.0):
+        """
+        Next message of the queue, None if nothing arrived within `timeout`
+        """
+        try:
+            return self.get_queue(name).get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class FileQueueBackend:
+    """
+    Queues kept as one JSON file per message in a shared directory, so workers
+    on other machines can take part over a network file system
+    """
+
+    def __init__(self, directory, poll_interval=0.1):
+        self.directory = directory
+        self.poll_interval = poll_interval
+
+    def queue_directory(self, name):
+        path = os.path.join(self.directory, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def put(self, name, message):
+        path = os.path.join(self.queue_directory(name), f"{time.time_ns():020d}-{uuid.uuid4().hex}.json")
+        with open(path + ".tmp", "w") as message_file:
+            json.dump(message, message_file)
+        os.replace(path + ".tmp", path)
+
+    def get(self, name, timeout=1.0):
+        """
+        Next message of the queue, None if nothing arrived within `timeout`
+        """
+        directory = self.queue_directory(name)
+        deadline = time.monotonic() + timeout
+        while True:
+            for file_name in sorted(os.listdir(directory)):
+                if not file_name.endswith(".json"):
+                    continue
+                path = os.path.join(directory, file_name)
+                # Renaming claims the message, only one reader can win
+                claimed = f"{path}.{uuid.uuid4().hex}.claimed"
+                try:
+                    os.rename(path, claimed)
+                except FileNotFoundError:
+                    continue
+                with open(claimed) as message_file:
+                    message = json.load(message_file)
+                os.remove(claimed)
+                return message
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+
+class CrawlWorker:
+    """
+    Fetches the URLs the coordinator sends it, the ones of its partition of
+    the hash ring, and reports each page's links on the "results" queue. The
+    frontier and its budgets stay with the coordinator
+    """
+
+    def __init__(self, worker_id, crawler, ring, backend):
+        self.worker_id = worker_id
+        self.crawler = crawler
+        self.ring = ring
+        self.backend = backend
+        self.session = crawler.worker_session()
+
+    def run(self):
+        # A worker started on its own counts the crawl deadline from its start
+        self.crawler.urls_to_visit.start_clock()
+        while True:
+            message = self.backend.get(self.worker_id)
+            if message is None:
+                continue
+            if message["type"] == "stop":
+                return
+            for url in message["urls"]:
+                self.crawl_url(url)
+
+    def crawl_url(self, url):
+        html = self.crawler.fetch_page(self.session, url)
+        links = None if html is None or html is RETRY_LATER else self.crawler.page_links(url, html)
+        # The redirect is sent along for coordinators in another process
+        self.backend.put("results", {
+            "type": "page", "url": url, "links": links, "retry": html is RETRY_LATER,
+            "redirect": self.crawler.redirects.get(url),
+            "digest": self.crawler.page_digests.pop(url, None),
+            "fingerprint": self.crawler.page_fingerprints.pop(url, None),
+        })
+
+
 class WebCrawler:
     """
     WebCrawler Class
     """
 
-    def __init__(self, base_url, login_url=None, username=None, password=None):
+    # Statuses worth retrying
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    # Backoff before retry n is random up to min(retry_cap, retry_base * 2 ** n) seconds
+    retry_base = 0.5
+    retry_cap = 30.0
+    # Longest Retry-After slept when there is no politeness scheduler to pause the host
+    max_retry_after = 300.0
+
+    # Bytes read per chunk when streaming a page
+    chunk_size = 64 * 1024
+
+    # Attributes extract_links needs, sent to the parser processes
+    parser_attributes = ("base_url", "scope", "query_policy", "file_extensions_to_ignore", "link_extractor", "canonicalizer")
+
+    def __init__(self, base_url, login_url=None, username=None, password=None, politeness=True, store=None,
+                 compact_visited=False, visited_error_rate=0.01, visited_capacity=1_000_000,
+                 max_pages=None, max_depth=None, max_duration=None, scorer=None, http_cache=None,
+                 record=None, replay=None, max_page_bytes=5_000_000, backend=None,
+                 max_attempts=3, retry_rounds=2, breaker=None,
+                 connect_timeout=10.0, read_timeout=30.0, total_timeout=60.0, robots=False, sitemap=False,
+                 link_extractor=None, stream_parse=False, url_cache_size=100_000, scope=None, query_policy=None,
+                 learn_duplicates=False, duplicate_support=2, near_duplicates=None, near_duplicate_distance=3):
         """
         Constructor
         """
+        # Which query parameters make a page distinct, see QueryPolicy
+        self.query_policy = query_policy or QueryPolicy()
         self.base_url = self.normalize_url(base_url)
         self.login_url = login_url
         self.username = username
         self.password = password
+        # Response archive written with `record` or served with `replay` instead of the network
+        self.archive = ResponseArchive(record or replay) if record or replay else None
+        self.replay = bool(replay)
+        self.backend = backend or RequestsBackend()
         self.session = requests.Session()
-        self.visited_urls = set()
-        self.urls_to_visit = [self.base_url]
-        self.internal_urls = set()
+        self.backend.configure(self.session, self.archive, self.replay)
+        # Directory of the on-disk URL sets when the compact visited set is used,
+        # deleted by close() or when the program exits
+        self.compact_directory = tempfile.TemporaryDirectory(prefix="qaits-urls-") if compact_visited else None
+        self.visited_error_rate = visited_error_rate
+        self.visited_capacity = visited_capacity
+        self.visited_urls = self.new_url_set("visited")
+        budgets = {"max_pages": max_pages, "max_depth": max_depth, "max_duration": max_duration}
+        if scorer:
+            self.urls_to_visit = BestFirstFrontier(seen=self.new_url_set("seen"), scorer=scorer, **budgets)
+        else:
+            self.urls_to_visit = Frontier(seen=self.new_url_set("seen"), **budgets)
+        self.internal_urls = self.new_url_set("internal")
         self.file_extensions_to_ignore = {
             ".pdf",
             ".zip",
@@ -94,35 +2301,265 @@ class WebCrawler:
             ".wmv",
             ".mkv",
         }
-        self.url_to_node = {self.base_url: Node(self.base_url)}
+        self.url_to_node = {}
+        # Hosts, path prefixes and patterns of the pages to crawl, the start page's host by default
+        self.scope = scope or ScopeMatcher([urlparse(self.base_url).netloc])
+        self.canonicalizer = UrlCanonicalizer(self.scope, self.file_extensions_to_ignore, url_cache_size, self.query_policy)
+        # Links cached by a run with another scope or query policy are extracted again
+        self.links_key = hashlib.blake2b(repr(
+            (self.scope.settings, self.query_policy.settings, sorted(self.file_extensions_to_ignore))
+        ).encode(), digest_size=8).hexdigest()
+        self.link_extractor = link_extractor or link_extractors[default_link_extractor]()
+        # Parse pages while they download, see StreamingLinks
+        self.stream_parse = stream_parse
+        self.scheduler = PolitenessScheduler() if politeness else None
+        self.http_cache = http_cache
+        self.max_page_bytes = max_page_bytes
+        # Attempts per fetch, then rounds of retries for the deferred URLs at the end of the crawl
+        self.max_attempts = max_attempts
+        self.retry_rounds = retry_rounds
+        self.retry_round = 0
+        self.deferred = []
+        self.breaker = breaker or CircuitBreaker()
+        # Per request timeouts in seconds, all cut short by the crawl deadline (max_duration)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.robots = RobotsCache(
+            self.fetch_text, self.session.headers.get("User-Agent", "*"), self.scheduler
+        ) if robots else None
+        # Final URL of each URL that redirected, and (scheme, host) moves such as http -> https
+        self.redirects = {}
+        self.host_redirects = {}
+        # Where each page being crawled was redirected to, the base of its relative links
+        self.final_urls = {}
+        for source, final in (http_cache.redirects() if http_cache else {}).items():
+            self.add_redirect(source, final)
+        # URL spellings learned to serve the same page, and the body digests of the pages waiting to be recorded
+        self.duplicates = DuplicateUrlRules(
+            duplicate_support, http_cache.duplicate_rules() if http_cache else ()
+        ) if learn_duplicates else None
+        self.page_digests = {}
+        # What to do with pages within near_duplicate_distance bits of an earlier page's SimHash:
+        # "report" them, "stop" following their links, "skip-java" their classes, or "prune" (both)
+        self.near_duplicates = near_duplicates
+        self.simhashes = SimHashIndex(near_duplicate_distance) if near_duplicates else None
+        self.page_fingerprints = {}
+        # {url: earlier page it is a near-duplicate of}
+        self.near_duplicate_of = {}
+        # {url: (lastmod, priority)} read from the sitemaps, see load_sitemaps()
+        self.sitemap = None
+        self.sitemap_seeded = not sitemap
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+        self.store = store
+
+        if self.store and self.store.base_url():
+            self.restore()
+        else:
+            self.urls_to_visit.add(self.base_url)
+            self.url_to_node[self.base_url] = Node(self.base_url)
+            if self.store:
+                self.store.start(self.base_url)
+                self.store.add_node(self.base_url, None)
 
-        if self.login_url and self.username and self.password:
+        if self.login_url and self.username and self.password and not self.replay:
             self.login()
 
+        if sitemap:
+            self.load_sitemaps()
+        if hasattr(scorer, "prepare"):
+            scorer.prepare(self)
+
+    def new_url_set(self, name):
+        """
+        Empty set for URLs, a Bloom filter backed CompactUrlSet when compact_visited is on
+        """
+        if not self.compact_directory:
+            return set()
+        return CompactUrlSet(
+            os.path.join(self.compact_directory.name, f"{name}.db"),
+            capacity=self.visited_capacity,
+            error_rate=self.visited_error_rate,
+        )
+
+    def close(self):
+        """
+        Close the crawl store, the HTTP cache and the on-disk URL sets, deleting
+        their directory. The crawler can not be used afterwards
+        """
+        self.session.close()
+        if self.store:
+            self.store.close()
+        if self.http_cache:
+            self.http_cache.close()
+        if not self.compact_directory:
+            return
+        for urls in (self.visited_urls, self.urls_to_visit.seen, self.internal_urls):
+            urls.close()
+        self.compact_directory.cleanup()
+
+    def restore(self):
+        """
+        Rebuild the hierarchy, visited set and frontier from the crawl store
+        """
+        for url, parent, internal, status in self.store.load():
+            if status == "alias":
+                # Another spelling of a recorded page, see drop_alias()
+                self.visited_urls.add(url)
+                self.urls_to_visit.mark_seen(url)
+                continue
+            if parent is None:
+                node = Node(url)
+                # Also under the start URL when the start page was renamed to where it redirected
+                self.url_to_node[self.base_url] = node
+            else:
+                node = Node(url, self.url_to_node[parent].depth + 1)
+                self.url_to_node[parent].add_child(node)
+            self.url_to_node[url] = node
+            if internal:
+                self.internal_urls.add(url)
+            if status == "pending":
+                self.urls_to_visit.add(url, node.depth)
+            else:
+                self.urls_to_visit.mark_seen(url)
+                if status == "visited":
+                    self.visited_urls.add(url)
+        print(f"Resumed crawl '{self.store.crawl_id}': {len(self.visited_urls)} pages visited, {len(self.urls_to_visit)} pending")
+
+    def load_sitemap_priorities(self):
+        """
+        Map each internal URL listed in the sitemaps to its <priority>
+        """
+        return {url: priority for url, (_, priority) in self.load_sitemaps().items()}
+
+    def load_sitemaps(self):
+        """
+        Map each internal page listed in the site's sitemaps to its
+        (<lastmod>, <priority>). The sitemaps are read once per crawl
+        """
+        if self.sitemap is None:
+            self.sitemap = {}
+            for sitemap_url in self.sitemap_urls():
+                for loc, lastmod, priority in self.iter_sitemap(sitemap_url):
+                    url = self.normalize_url(loc)
+                    if self.is_internal_url(url) and not self.is_file_url(url):
+                        self.sitemap[url] = (lastmod, priority)
+            print(f"Found {len(self.sitemap)} pages in the sitemaps")
+        return self.sitemap
+
+    def sitemap_urls(self):
+        """
+        Sitemaps announced in robots.txt, /sitemap.xml otherwise
+        """
+        sitemaps = self.robots.sitemaps(self.base_url) if self.robots else []
+        return sitemaps or [urljoin(self.base_url, "/sitemap.xml")]
+
+    def iter_sitemap(self, sitemap_url, seen=None):
+        """
+        Stream the (loc, lastmod, priority) entries of a sitemap, following
+        sitemap indexes. Entries are parsed as they arrive and then dropped,
+        so large sitemaps never sit in memory as a whole
+        """
+        seen = set() if seen is None else seen
+        if sitemap_url in seen:
+            return
+        seen.add(sitemap_url)
+        children = []
+        connect, read, _ = self.request_timeouts()
+        try:
+            with self.session.get(sitemap_url, stream=True, timeout=(connect, read)) as response:
+                if response.status_code != 200:
+                    return
+                response.raw.decode_content = True
+                stream = response.raw
+                if sitemap_url.endswith(".gz") and response.headers.get("Content-Encoding") != "gzip":
+                    stream = gzip.GzipFile(fileobj=stream)
+                for _, element in ElementTree.iterparse(stream):
+                    # Tags carry the sitemap namespace, e.g. {http://www.sitemaps.org/...}url
+                    tag = element.tag.rpartition("}")[2]
+                    if tag not in ("url", "sitemap"):
+                        continue
+                    fields = {child.tag.rpartition("}")[2]: (child.text or "").strip() for child in element}
+                    element.clear()
+                    if not fields.get("loc"):
+                        continue
+                    if tag == "sitemap":
+                        children.append(fields["loc"])
+                        continue
+                    try:
+                        priority = float(fields.get("priority") or 0.5)
+                    except ValueError:
+                        priority = 0.5
+                    yield fields["loc"], self.parse_lastmod(fields.get("lastmod")), priority
+        except (requests.RequestException, Urllib3Error, ElementTree.ParseError, OSError) as e:
+            print(f"Failed to read {sitemap_url}: {e}")
+        for child in children:
+            yield from self.iter_sitemap(child, seen)
+
+    @staticmethod
+    def parse_lastmod(value):
+        """
+        UTC datetime of a W3C datetime <lastmod>, None if missing or invalid
+        """
+        if not value:
+            return None
+        try:
+            lastmod = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        if lastmod.tzinfo is None:
+            lastmod = lastmod.replace(tzinfo=timezone.utc)
+        return lastmod.astimezone(timezone.utc)
+
+    def fetch_text(self, url):
+        """
+        Small auxiliary file such as robots.txt as (status, text), (None, None) if it could not be fetched
+        """
+        connect, read, _ = self.request_timeouts()
+        try:
+            response = self.session.get(url, timeout=(connect, read))
+        except requests.RequestException as e:
+            print(f"Failed to fetch {url}: {e}")
+            return None, None
+        return response.status_code, response.text
+
     def normalize_url(self, url):
         """
         Normalize the URL's to treats URL's with different schemes,
-        www prefixes, and fragments as equivalent
+        www prefixes, fragments and tracking parameters as equivalent
         """
         parsed_url = urlparse(url)
         scheme = parsed_url.scheme
-        netloc = parsed_url.netloc.lstrip("www.")
+        netloc = parsed_url.netloc.removeprefix("www.")
         path = parsed_url.path
-        normalized_url = urlunparse((scheme, netloc, path, "", "", ""))
+        query = self.query_policy.canonical(netloc, parsed_url.query)
+        normalized_url = urlunparse((scheme, netloc, path, "", query, ""))
         return normalized_url
 
     def is_internal_url(self, url):
         """
-        Check if the URL belongs to the same domain
+        Check if the URL is in the crawl scope
+        """
+        return self.scope.allows(url)
+
+    def check_redirect(self, url, location):
+        """
+        Raise OutOfScope if following a redirect from `url` to `location` would
+        leave the crawl scope, AlreadyCrawled if it leads to a crawled page
         """
-        base_netloc = urlparse(self.base_url).netloc
-        return urlparse(url).netloc.rstrip(".").endswith(base_netloc)
+        target = self.normalize_url(urljoin(url, location))
+        if not self.is_internal_url(target):
+            raise OutOfScope(f"{url} redirects out of scope to {target}")
+        if self.canonical(target) in self.visited_urls:
+            raise AlreadyCrawled(target)
 
     def is_file_url(self, url):
         """
         Check if the URL is to download a file & ignore it
         """
-        return any(url.lower().endswith(ext) for ext in self.file_extensions_to_ignore)
+        path = urlparse(url).path.lower()
+        return any(path.endswith(ext) for ext in self.file_extensions_to_ignore)
 
     def login(self):
         """
@@ -134,6 +2571,8 @@ class WebCrawler:
         # Run in headless mode
         options.add_argument("--headless")
         driver = webdriver.Chrome(options=options, service=Service(ChromeDriverManager().install()))
+        if self.total_timeout:
+            driver.set_page_load_timeout(self.total_timeout)
 
         try:
             # Open the login page
@@ -155,54 +2594,853 @@ class WebCrawler:
         finally:
             driver.quit()
 
+    def progress_bar(self):
+        """
+        Progress bar shared by the crawl modes
+        """
+        return Progress(
+            TextColumn("[bold green]{task.description}"),
+            BarColumn(bar_width=None),
+            TextColumn("[progress.percentage]{task.percentage:>3.1f}%"),
+            TextColumn("[green]{task.completed}/{task.total} URLs Crawled"),
+            transient=True,
+        )
+
     def crawl(self):
-        with Progress(
-                TextColumn("[bold green]{task.description}"),
-                BarColumn(bar_width=None),
-                TextColumn("[progress.percentage]{task.percentage:>3.1f}%"),
-                TextColumn("[green]{task.completed}/{task.total} URLs Crawled"),
-                transient=True,
-        ) as progress:
+        with self.progress_bar() as progress:
             task = progress.add_task("Crawling URLs", total=len(self.urls_to_visit))
-            while self.urls_to_visit:
+            crawled = 0
+            while self.urls_to_visit or self.refill():
                 # print(len(self.urls_to_visit))
-                current_url = self.urls_to_visit.pop(0)
-                if current_url not in self.visited_urls:
+                current_url = self.urls_to_visit.pop()
+                if self.settle_alias(current_url):
+                    continue
+                progress.update(task, description=f"Crawling: {current_url}")
+                self.visit_url(current_url)
+                crawled += 1
+                progress.update(
+                    task,
+                    completed=crawled,
+                    total=crawled + len(self.urls_to_visit),
+                )
+                # time.sleep(1)
+
+    def crawl_async(self, concurrency=10):
+        """
+        Crawl with up to `concurrency` requests in flight. Pages are handled in
+        the order they were queued, so the hierarchy is the same as crawl()
+        """
+        asyncio.run(self._crawl_async(concurrency))
+
+    async def _crawl_async(self, concurrency):
+        # Imported here, only crawls with --concurrency load aiohttp
+        import aiohttp
+        # Carry over the login cookies and headers of the requests session
+        cookies = {cookie.name: cookie.value for cookie in self.session.cookies}
+        connector = aiohttp.TCPConnector(limit=concurrency)
+
+        async def on_redirect(session, context, params):
+            self.check_redirect(str(params.url), params.response.headers.get("Location", ""))
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_redirect.append(on_redirect)
+        async with aiohttp.ClientSession(
+                connector=connector, cookies=cookies, headers=dict(self.session.headers), trace_configs=[trace]
+        ) as session:
+            with self.progress_bar() as progress:
+                task = progress.add_task("Crawling URLs", total=len(self.urls_to_visit))
+                crawled = 0
+                in_flight = deque()
+                while self.urls_to_visit or in_flight or self.refill():
+                    while self.urls_to_visit and len(in_flight) < concurrency:
+                        url = self.urls_to_visit.pop()
+                        if self.in_flight_alias(url, in_flight):
+                            in_flight.append((url, None))
+                        elif not self.settle_alias(url):
+                            in_flight.append((url, asyncio.ensure_future(self.fetch_async(session, url))))
+                    if not in_flight:
+                        continue
+
+                    # Wait for the oldest request so pages are handled in queue order
+                    current_url, fetch = in_flight.popleft()
+                    if fetch is None:
+                        if self.settle_alias(current_url):
+                            continue
+                        fetch = self.fetch_async(session, current_url)
+                    progress.update(task, description=f"Crawling: {current_url}")
+                    html = await fetch
+                    if html is None or html is RETRY_LATER:
+                        self.finish_page(current_url, html)
+                    else:
+                        self.finish_page(current_url, self.page_links(current_url, html))
+                    crawled += 1
+                    progress.update(
+                        task,
+                        completed=crawled,
+                        total=crawled + len(in_flight) + len(self.urls_to_visit),
+                    )
+
+    async def fetch_async(self, session, url):
+        """
+        Fetch the page body, None if the page could not be fetched and
+        RETRY_LATER if it kept failing for reasons that may go away
+        """
+        import aiohttp
+        html = self.unchanged_body(url)
+        if html is not None:
+            if url in self.redirects:
+                self.final_urls[url] = self.redirects[url]
+            return html
+        for attempt in range(self.max_attempts):
+            if attempt and self.urls_to_visit.expired():
+                break
+            if not self.breaker.allow(url):
+                return RETRY_LATER
+            if self.scheduler and not await self.scheduler.acquire_async(url, self.urls_to_visit.remaining):
+                # The host is paused past the crawl deadline
+                self.count("deferred")
+                return RETRY_LATER
+            start = time.monotonic()
+            status = retry_after = error = None
+            headers = self.http_cache.validators(url) if self.http_cache else {}
+            connect, read, total = self.request_timeouts()
+            timeout = aiohttp.ClientTimeout(total=total, connect=connect, sock_read=read)
+            try:
+                async with session.get(url, headers=headers, timeout=timeout) as response:
+                    status = response.status
+                    retry_after = PolitenessScheduler.parse_retry_after(response.headers.get("Retry-After"))
+                    if status == 200:
+                        self.note_redirects(url, response.history, response.url)
+                        skip = self.skip_reason(response.headers)
+                        body = bytearray()
+                        if not skip:
+                            async for chunk in response.content.iter_chunked(self.chunk_size):
+                                body += chunk
+                                if len(body) > self.max_page_bytes:
+                                    skip = "skipped_too_large"
+                                    break
+                        self.breaker.success(url)
+                        if skip:
+                            self.count(skip)
+                            return None
+                        html = bytes(body).decode(text_encoding(response.charset), errors="replace")
+                        if self.http_cache:
+                            self.http_cache.store(url, response.headers, html, time.monotonic() - start, self.lastmod(url))
+                        return html
+                    if status == 304 and self.http_cache:
+                        self.note_redirects(url, response.history, response.url)
+                        self.breaker.success(url)
+                        return self.http_cache.reuse(url, time.monotonic() - start)
+            except OutOfScope as e:
+                print(e)
+                self.count("redirected_out_of_scope")
+                return None
+            except AlreadyCrawled as e:
+                # An empty page, finish_page() then settles the URL as an alias of the crawled one
+                self.remember_redirect(url, e.args[0])
+                return ""
+            except asyncio.TimeoutError:
+                self.count("timed_out")
+                error = TotalTimeout("no complete answer within the timeouts")
+            except aiohttp.ClientError as e:
+                error = e
+            finally:
+                if self.scheduler:
+                    self.scheduler.release(url, status, time.monotonic() - start, retry_after)
+            if not self.should_retry(url, status, error):
+                return None
+            if attempt + 1 < self.max_attempts:
+                await asyncio.sleep(self.retry_delay(attempt, retry_after))
+        self.count("deferred")
+        print(f"Failed to fetch {url}: {error or f'status {status}'}, deferring it")
+        return RETRY_LATER
+
+    def crawl_threaded(self, workers=8, parse_processes=None):
+        """
+        Crawl with a pool of `workers` threads, each with its own requests session
+        carrying the login cookies. With `parse_processes` the pages are parsed in
+        a process pool and only their link lists come back. Worker threads only
+        fetch and parse, the frontier, visited set and url_to_node are only
+        updated from this thread and in queue order, so the hierarchy is the
+        same as crawl()
+        """
+        local = threading.local()
+        parse_pool = None
+        if parse_processes:
+            attributes = {name: getattr(self, name) for name in self.parser_attributes}
+            parse_pool = ProcessPoolExecutor(max_workers=parse_processes, initializer=_init_parser, initargs=(attributes,))
+        # Fetches started for links of pages still downloading, before the
+        # links reach the frontier
+        prefetched = {}
+        prefetch_lock = threading.Lock()
+
+        def prefetch(link, depth):
+            # Only links the frontier would take, under the URL it would queue them as
+            link = self.canonical(link)
+            if link in self.url_to_node or not self.urls_to_visit.admits(depth):
+                return
+            if self.robots and not self.robots.allowed(link):
+                return
+            with prefetch_lock:
+                if link in prefetched or len(prefetched) >= workers:
+                    return
+                self.count("prefetched")
+                prefetched[link] = pool.submit(fetch, link, depth)
+
+        def fetch(url, depth):
+            if not hasattr(local, "session"):
+                local.session = self.worker_session()
+            listener = StreamingLinks(self, url, lambda link: prefetch(link, depth + 1)) if self.stream_parse else None
+            html = self.fetch_page(local.session, url, listener)
+            if html is None or html is RETRY_LATER:
+                return html
+            if listener:
+                return self.page_links(url, html, listener.result)
+            if parse_pool:
+                return self.page_links(url, html, lambda *page: parse_pool.submit(_parse_links, *page).result())
+            return self.page_links(url, html)
+
+        def start(url):
+            with prefetch_lock:
+                future = prefetched.pop(url, None)
+            return future or pool.submit(fetch, url, self.url_to_node[url].depth)
+
+        def drop_prefetches(links, queued=False):
+            # Links that did not make it into the frontier will never be popped
+            with prefetch_lock:
+                for link in links or ():
+                    if link in prefetched and (queued or link not in self.urls_to_visit):
+                        self.count("prefetch_wasted")
+                        prefetched.pop(link).cancel()
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool, self.progress_bar() as progress:
+                task = progress.add_task("Crawling URLs", total=len(self.urls_to_visit))
+                crawled = 0
+                in_flight = deque()
+                while self.urls_to_visit or in_flight or self.refill():
+                    while self.urls_to_visit and len(in_flight) < workers:
+                        url = self.urls_to_visit.pop()
+                        if self.in_flight_alias(url, in_flight):
+                            in_flight.append((url, None))
+                        elif not self.settle_alias(url):
+                            in_flight.append((url, start(url)))
+                        else:
+                            drop_prefetches([url], queued=True)
+                    if not in_flight:
+                        continue
+
+                    # Wait for the oldest request so pages are handled in queue order
+                    current_url, future = in_flight.popleft()
+                    if future is None:
+                        if self.settle_alias(current_url):
+                            drop_prefetches([current_url], queued=True)
+                            continue
+                        future = start(current_url)
                     progress.update(task, description=f"Crawling: {current_url}")
-                    self.visit_url(current_url)
+                    links = future.result()
+                    self.finish_page(current_url, links)
+                    if prefetched and links is not RETRY_LATER:
+                        drop_prefetches(links)
+                    crawled += 1
                     progress.update(
                         task,
-                        advance=1,
-                        total=len(self.visited_urls) + len(self.urls_to_visit),
+                        completed=crawled,
+                        total=crawled + len(in_flight) + len(self.urls_to_visit),
                     )
-                    # time.sleep(1)
+                drop_prefetches(list(prefetched), queued=True)
+        finally:
+            if parse_pool:
+                parse_pool.shutdown(cancel_futures=True)
+
+    def crawl_distributed(self, worker_ids, backend=None, local_workers=True, window=None):
+        """
+        Coordinate a crawl partitioned over `worker_ids` by consistent hashing.
+        With `local_workers` the workers run as threads of this process,
+        otherwise they are started elsewhere with run_worker() on the same
+        backend. The frontier stays with the coordinator, which sends each URL
+        it pops to the worker owning it, at most `window` at a time, and
+        handles the reported pages in queue order, so the budgets, robots.txt
+        and learned duplicate rules apply as in crawl() and the hierarchy is
+        the same
+        """
+        backend = backend or LocalQueueBackend()
+        ring = HashRing(worker_ids)
+        window = window or 4 * len(worker_ids)
+        threads = []
+        if local_workers:
+            for worker_id in worker_ids:
+                thread = threading.Thread(target=CrawlWorker(worker_id, self, ring, backend).run, daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        def send(url):
+            backend.put(ring.owner(url), {"type": "urls", "urls": [url]})
+
+        # Reports that arrived before the page ahead of them was handled
+        reports = {}
+        with self.progress_bar() as progress:
+            task = progress.add_task("Crawling URLs", total=len(self.urls_to_visit))
+            crawled = 0
+            in_flight = deque()
+            while self.urls_to_visit or in_flight or self.refill():
+                while self.urls_to_visit and len(in_flight) < window:
+                    url = self.urls_to_visit.pop()
+                    if self.in_flight_alias(url, in_flight):
+                        in_flight.append((url, False))
+                    elif not self.settle_alias(url):
+                        send(url)
+                        in_flight.append((url, True))
+                if not in_flight:
+                    continue
+
+                # Wait for the oldest page so pages are handled in queue order
+                current_url, sent = in_flight.popleft()
+                if not sent:
+                    if self.settle_alias(current_url):
+                        continue
+                    send(current_url)
+                progress.update(task, description=f"Crawling: {current_url}")
+                while current_url not in reports:
+                    message = backend.get("results")
+                    if message is not None:
+                        reports[message["url"]] = message
+                    elif self.urls_to_visit.expired():
+                        break
+                if current_url not in reports:
+                    # Past the deadline without a report, left in the frontier
+                    # like the pages a deadline leaves queued in crawl()
+                    for url, _ in [(current_url, sent), *in_flight]:
+                        self.urls_to_visit.requeue(url, self.url_to_node[url].depth)
+                    break
+                self.finish_page(current_url, self.merge_report(reports.pop(current_url)))
+                crawled += 1
+                progress.update(
+                    task,
+                    completed=crawled,
+                    total=crawled + len(in_flight) + len(self.urls_to_visit),
+                )
+
+        for worker_id in worker_ids:
+            backend.put(worker_id, {"type": "stop"})
+        for thread in threads:
+            thread.join()
+
+    def run_worker(self, worker_id, worker_ids, backend):
+        """
+        Run as one of the workers of a crawl_distributed() coordinator
+        """
+        CrawlWorker(worker_id, self, HashRing(worker_ids), backend).run()
+
+    def merge_report(self, report):
+        """
+        Take over what the worker learned fetching a page, returns the page's
+        links for finish_page()
+        """
+        url = report["url"]
+        if report.get("redirect") and self.redirects.get(url) != report["redirect"]:
+            self.add_redirect(url, report["redirect"])
+        if report.get("digest"):
+            self.page_digests[url] = report["digest"]
+        if report.get("fingerprint") is not None:
+            self.page_fingerprints[url] = report["fingerprint"]
+        return RETRY_LATER if report.get("retry") else report["links"]
+
+    def worker_session(self):
+        """
+        Session for a worker with a copy of the login cookies, with its own
+        connection pool unless the fetch backend shares one
+        """
+        return self.backend.new_session(self)
+
+    def fetch_page(self, session, url, listener=None):
+        """
+        Fetch the page body, None if the page could not be fetched and
+        RETRY_LATER if it kept failing for reasons that may go away. The
+        body is handed to `listener` while it downloads, see read_body()
+        """
+        html = self.unchanged_body(url)
+        if html is not None:
+            if url in self.redirects:
+                self.final_urls[url] = self.redirects[url]
+            return html
+        for attempt in range(self.max_attempts):
+            if attempt and self.urls_to_visit.expired():
+                break
+            if not self.breaker.allow(url):
+                return RETRY_LATER
+            if self.scheduler and not self.scheduler.acquire(url, self.urls_to_visit.remaining):
+                # The host is paused past the crawl deadline
+                self.count("deferred")
+                return RETRY_LATER
+            start = time.monotonic()
+            status = retry_after = error = None
+            headers = self.http_cache.validators(url) if self.http_cache else {}
+            connect, read, total = self.request_timeouts()
+            try:
+                # response = requests.get(url)
+                with self.backend.stream(session, url, headers, (connect, read), self.check_redirect) as response:
+                    status = response.status_code
+                    retry_after = PolitenessScheduler.parse_retry_after(response.headers.get("Retry-After"))
+                    if status == 200:
+                        self.note_redirects(url, response.history, response.url)
+                        if listener and response.history:
+                            # Relative links resolve against where the page ended up
+                            listener.url = str(response.url)
+                        self.breaker.success(url)
+                        html = self.read_body(response, None if total is None else start + total, listener)
+                        if html is not None and self.http_cache:
+                            self.http_cache.store(url, response.headers, html, time.monotonic() - start, self.lastmod(url))
+                        return html
+                    if status == 304 and self.http_cache:
+                        self.note_redirects(url, response.history, response.url)
+                        self.breaker.success(url)
+                        return self.http_cache.reuse(url, time.monotonic() - start)
+            except OutOfScope as e:
+                print(e)
+                self.count("redirected_out_of_scope")
+                return None
+            except AlreadyCrawled as e:
+                # An empty page, finish_page() then settles the URL as an alias of the crawled one
+                self.remember_redirect(url, e.args[0])
+                return ""
+            except (TotalTimeout, *self.backend.errors) as e:
+                error = e
+            finally:
+                if self.scheduler:
+                    self.scheduler.release(url, status, time.monotonic() - start, retry_after)
+            if not self.should_retry(url, status, error):
+                return None
+            if attempt + 1 < self.max_attempts:
+                time.sleep(self.retry_delay(attempt, retry_after))
+        self.count("deferred")
+        print(f"Failed to fetch {url}: {error or f'status {status}'}, deferring it")
+        return RETRY_LATER
+
+    def note_redirects(self, url, history, final_url):
+        """
+        Remember where the URL and every hop of its redirect chain ended up
+        """
+        if not history:
+            return
+        self.final_urls[url] = str(final_url)
+        final = self.normalize_url(str(final_url))
+        if not self.is_internal_url(final):
+            return
+        for source in [url] + [self.normalize_url(str(hop.url)) for hop in history]:
+            self.remember_redirect(source, final)
+
+    def remember_redirect(self, source, final):
+        if source != final and self.redirects.get(source) != final:
+            self.count("redirects")
+            self.add_redirect(source, final)
+            if self.http_cache:
+                self.http_cache.store_redirect(source, final)
+
+    def add_redirect(self, source, final):
+        self.redirects[source] = final
+        source_parts, final_parts = urlparse(source), urlparse(final)
+        if source_parts.path == final_parts.path and source_parts[:2] != final_parts[:2]:
+            # Only the scheme or host changed, so every page of the old host moved the same way
+            self.host_redirects[source_parts[:2]] = final_parts[:2]
+
+    def canonical(self, url):
+        """
+        Where the URL is known to redirect to, the URL itself otherwise, in
+        the spelling the learned duplicate rules rewrite it to
+        """
+        final = self.redirects.get(url)
+        if final is None:
+            final = url
+            if self.host_redirects:
+                parts = urlparse(url)
+                moved = self.host_redirects.get(parts[:2])
+                if moved:
+                    final = urlunparse(moved + parts[2:])
+        return self.duplicates.rewrite(final) if self.duplicates else final
+
+    def settle_alias(self, url):
+        """
+        Close a queued URL that redirects to a page which was already crawled,
+        without fetching it. True if it was settled
+        """
+        if self.canonical(url) not in self.visited_urls:
+            return False
+        self.count("redirect_aliases")
+        self.drop_alias(url)
+        self.page_done()
+        return True
+
+    def drop_alias(self, url):
+        """
+        Take the node of a URL that turned out to be another spelling of a
+        recorded page out of the hierarchy and the internal URLs
+        """
+        self.visited_urls.add(url)
+        node = self.url_to_node.get(url)
+        if node is None or node.url != url:
+            # Renamed to the URL it redirected to, it is the page's own node
+            return
+        del self.url_to_node[url]
+        node.parent.children.remove(node)
+        self.internal_urls.discard(url)
+        if self.store:
+            self.store.set_status(url, "alias")
+
+    def in_flight_alias(self, url, in_flight):
+        """
+        Check if the URL is another spelling of a page that is still being
+        fetched, it is then settled once that page is recorded instead of
+        being fetched as well
+        """
+        final = self.canonical(url)
+        return final != url and any(final == other for other, _ in in_flight)
+
+    def lastmod(self, url):
+        """
+        Sitemap <lastmod> of the page, None if unknown
+        """
+        return self.sitemap.get(url, (None, None))[0] if self.sitemap else None
+
+    def unchanged_body(self, url):
+        """
+        Cached body of a page the sitemap says did not change since the
+        previous run, None if it has to be fetched
+        """
+        lastmod = self.lastmod(url)
+        if not self.http_cache or lastmod is None:
+            return None
+        html = self.http_cache.unchanged(url, lastmod)
+        if html is not None:
+            self.count("unchanged_lastmod")
+        return html
+
+    def should_retry(self, url, status, error):
+        """
+        Check if a failed attempt is worth retrying, feeding the host's circuit breaker
+        """
+        if error is None and status not in self.retry_statuses:
+            # The host answered, the page just is not there
+            self.breaker.success(url)
+            return False
+        if error is not None or status >= 500:
+            self.breaker.failure(url)
+        return True
+
+    def retry_delay(self, attempt, retry_after=None):
+        """
+        Full-jitter exponential backoff, the politeness scheduler already waits for Retry-After
+        """
+        if retry_after and self.scheduler:
+            return 0.0
+        delay = min(retry_after, self.max_retry_after) if retry_after else random.uniform(0, min(self.retry_cap, self.retry_base * 2 ** attempt))
+        remaining = self.urls_to_visit.remaining()
+        return delay if remaining is None else min(delay, remaining)
+
+    def request_timeouts(self):
+        """
+        Connect, read and total timeouts for the next request, none of them
+        reaching past the crawl deadline
+        """
+        timeouts = (self.connect_timeout, self.read_timeout, self.total_timeout)
+        remaining = self.urls_to_visit.remaining()
+        if remaining is None:
+            return timeouts
+        # Leave a moment for the request that starts right at the deadline to fail cleanly
+        remaining = max(remaining, 0.1)
+        return tuple(remaining if timeout is None else min(timeout, remaining) for timeout in timeouts)
+
+    def read_body(self, response, deadline=None, listener=None):
+        """
+        Download a streamed page, giving up as soon as it turns out not to be
+        HTML or to be larger than max_page_bytes. None if it was skipped,
+        TotalTimeout if the download is still running at `deadline`. The
+        text is also fed to `listener` (a StreamingLinks) as it arrives
+        """
+        skip = self.skip_reason(response.headers)
+        body = bytearray()
+        if not skip:
+            if listener:
+                listener.start()
+                decoder = codecs.getincrementaldecoder(text_encoding(response.encoding))(errors="replace")
+            for chunk in self.backend.iter_chunks(response, self.chunk_size):
+                if deadline is not None and time.monotonic() > deadline:
+                    self.count("timed_out")
+                    raise TotalTimeout(f"download took longer than {self.total_timeout}s")
+                body += chunk
+                if len(body) > self.max_page_bytes:
+                    skip = "skipped_too_large"
+                    break
+                if listener:
+                    listener.feed(decoder.decode(chunk))
+        if skip:
+            self.count(skip)
+            return None
+        return bytes(body).decode(text_encoding(response.encoding), errors="replace")
+
+    def skip_reason(self, headers):
+        """
+        Stats counter explaining why a response should not be downloaded, None to download it
+        """
+        content_type = headers.get("Content-Type", "")
+        if content_type and not is_html_content_type(content_type):
+            return "skipped_not_html"
+        content_length = headers.get("Content-Length", "")
+        if content_length.isdigit() and int(content_length) > self.max_page_bytes:
+            return "skipped_too_large"
+        return None
+
+    def count(self, name, amount=1):
+        with self.stats_lock:
+            self.stats[name] += amount
 
     def visit_url(self, url):
+        listener = StreamingLinks(self, url) if self.stream_parse else None
+        html = self.fetch_page(self.backend.main_session(self), url, listener)
+        if html is None or html is RETRY_LATER:
+            self.finish_page(url, html)
+        else:
+            self.finish_page(url, self.page_links(url, html, listener.result if listener else None))
+
+    def finish_page(self, url, links):
+        """
+        Record the outcome of a crawled page: its links, None if it failed, or
+        RETRY_LATER to try it again once the frontier is empty
+        """
+        self.final_urls.pop(url, None)
+        if links is RETRY_LATER:
+            self.deferred.append(url)
+        elif links is not None:
+            digest = self.page_digests.pop(url, None)
+            fingerprint = self.page_fingerprints.pop(url, None)
+            final = self.canonical(url)
+            if url in self.visited_urls or (final != url and final in self.visited_urls):
+                # Another spelling of a page that was already recorded
+                self.count("redirect_aliases")
+                self.drop_alias(url)
+            else:
+                if final != url:
+                    self.visited_urls.add(final)
+                    self.urls_to_visit.mark_seen(final)
+                    if final not in self.url_to_node:
+                        # Show the page under its final URL
+                        self.rename_node(url, final)
+                self.learn_duplicates(final, digest)
+                # Filed under the URL the page's node shows, the node keeps `url`
+                # when `final` already had a node of its own
+                near_duplicate = self.find_near_duplicate(self.url_to_node[url].url, fingerprint)
+                if near_duplicate and self.near_duplicates in ("stop", "prune"):
+                    links = []
+                self.record_links(url, links)
+        else:
+            self.page_failed(url)
+        self.page_done()
+
+    def rename_node(self, url, final):
+        """
+        Move the node of a page that redirected to its final URL, the node
+        stays reachable under `url` for the rest of the crawl
+        """
+        node = self.url_to_node[url]
+        node.url = final
+        self.url_to_node[final] = node
+        if url in self.internal_urls:
+            self.internal_urls.discard(url)
+            self.internal_urls.add(final)
+        if self.store:
+            self.store.rename(url, final)
+
+    def learn_duplicates(self, url, digest):
+        """
+        Feed the body digest of a recorded page to the duplicate URL rules,
+        saving the rules in the HTTP cache for later runs when they change
+        """
+        if not self.duplicates or digest is None:
+            return
+        before = self.duplicates.rules()
+        for rule in self.duplicates.observe(url, digest):
+            self.count("duplicate_rules_learned")
+            print(f"Learned duplicate URL rule for {urlparse(url).netloc}: {rule[0]} {rule[1]}".rstrip())
+        if self.http_cache and self.duplicates.rules() != before:
+            self.http_cache.store_duplicate_rules(self.duplicates.rules())
+
+    def find_near_duplicate(self, url, fingerprint):
+        """
+        File the SimHash of a recorded page, returns the earlier page it is a near-duplicate of, or None
+        """
+        if not self.simhashes or fingerprint is None:
+            return None
+        original = self.simhashes.add(url, fingerprint)
+        if original is not None:
+            self.count("near_duplicates")
+            self.near_duplicate_of[url] = original
+        return original
+
+    def refill(self):
+        """
+        Called when the frontier runs dry: queue the sitemap pages no link led
+        to, then the deferred pages. True if there is something to crawl again
+        """
+        return self.seed_sitemap() or self.requeue_deferred()
+
+    def seed_sitemap(self):
+        """
+        Queue the pages listed in the sitemaps that the link crawl did not
+        reach, as children of the start page
+        """
+        if self.sitemap_seeded or self.urls_to_visit.expired():
+            return False
+        self.sitemap_seeded = True
+        root = self.url_to_node[self.base_url]
+        for url in self.load_sitemaps():
+            if url in self.url_to_node or (self.robots and not self.robots.allowed(url)):
+                continue
+            if not self.urls_to_visit.add(url, root.depth + 1):
+                continue
+            self.count("sitemap_seeded")
+            node = Node(url, root.depth + 1)
+            self.url_to_node[url] = node
+            root.add_child(node)
+            self.internal_urls.add(url)
+            if self.store:
+                self.store.add_node(url, self.base_url)
+                self.store.mark_internal(url)
+        return bool(self.urls_to_visit)
+
+    def requeue_deferred(self):
+        """
+        Put the deferred URLs back in the frontier for another round of
+        retries once it is empty. True if there is something to crawl again
+        """
+        if not self.deferred:
+            return False
+        if self.retry_round >= self.retry_rounds or self.urls_to_visit.expired():
+            reason = "the crawl deadline was reached" if self.urls_to_visit.expired() else f"{self.retry_round} retry rounds"
+            for url in self.deferred:
+                print(f"Giving up on {url} after {reason}")
+                self.page_failed(url)
+            self.deferred = []
+            return False
+
+        self.retry_round += 1
+        # Give paused hosts a chance to come back, without stalling on them for long
+        wait = self.breaker.wait_time(self.deferred)
+        if wait:
+            time.sleep(min(wait, self.breaker.cooldown))
+        for url in self.deferred:
+            self.urls_to_visit.requeue(url, self.url_to_node[url].depth)
+        self.deferred = []
+        return bool(self.urls_to_visit)
+
+    def page_links(self, url, html, parse=None):
+        """
+        Links of the page, from the HTTP cache when the page was not modified,
+        otherwise extracted with `parse` (extract_links by default) relative
+        to the URL the page was redirected to
+        """
+        base = self.final_urls.pop(url, url)
+        if self.duplicates:
+            self.page_digests[url] = DuplicateUrlRules.digest(html)
+        if self.simhashes:
+            self.page_fingerprints[url] = SimHashIndex.fingerprint(html)
+        links = self.http_cache.links(url, self.links_key) if self.http_cache else None
+        if links is None:
+            links = (parse or self.extract_links)(base, html)
+            if self.http_cache:
+                self.http_cache.store_links(url, links, self.links_key)
+        return links
+
+    def extract_links(self, url, html):
+        """
+        Return the normalized internal links of the page in document order
+        """
+        links = []
+
+        for href in self.link_extractor.hrefs(html):
+            link = self.link_from_href(url, href)
+            if link:
+                links.append(link)
+        return links
+
+    def link_from_href(self, url, href):
+        """
+        Normalized internal link for an href found on the page, None if it is not one to follow
+        """
+        return self.canonicalizer(url, href)
+
+    def benchmark_link_extractors(self, rounds=3):
+        """
+        Pages/sec of each link extractor over the HTML pages of the replay
+        archive, checking they all find the same links as the default one
+        """
+        pages = []
+        for url in self.archive.index:
+            status, _, headers, body = self.archive.read(url)
+            if status == 200 and is_html_content_type(headers.get("Content-Type", "text/html")):
+                pages.append((url, body.decode("utf-8", errors="replace")))
+        if not pages:
+            print(f"No HTML pages in {self.archive.directory}")
+            return
+
+        default = self.link_extractor
+        expected = {url: self.extract_links(url, html) for url, html in pages}
+        print(f"Extracting links from {len(pages)} pages, best of {rounds} rounds")
         try:
-            # response = requests.get(url)
-            response = self.session.get(url)
-            if response.status_code == 200:
-                self.visited_urls.add(url)
-                soup = BeautifulSoup(response.text, "html.parser")
-                all_links = soup.find_all("a", href=True)
-                parent_node = self.url_to_node[url]
-
-                for link in all_links:
-                    absolute_url = urljoin(url, link["href"])
-                    normalized_url = self.normalize_url(urldefrag(absolute_url)[0])
-                    if (
-                            self.is_internal_url(normalized_url)
-                            and normalized_url not in self.visited_urls
-                            and not self.is_file_url(normalized_url)
-                    ):
-                        self.urls_to_visit.append(normalized_url)
-                        self.internal_urls.add(normalized_url)
-                        if normalized_url not in self.url_to_node:
-                            child_node = Node(normalized_url)
-                            self.url_to_node[normalized_url] = child_node
-                            parent_node.add_child(child_node)
-        except requests.RequestException as e:
-            print(f"Failed to fetch {url}: {e}")
+            for name, extractor_class in link_extractors.items():
+                self.link_extractor = extractor_class()
+                best = None
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    results = {url: self.extract_links(url, html) for url, html in pages}
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                mismatches = sum(results[url] != expected[url] for url, _ in pages)
+                check = "same links" if not mismatches else f"{mismatches} pages with different links"
+                print(f"  {name:10} {len(pages) / best:10.1f} pages/sec  ({check})")
+        finally:
+            self.link_extractor = default
+
+    def record_links(self, url, links):
+        """
+        Mark the page as visited and queue the links under the page's node
+        """
+        self.visited_urls.add(url)
+        parent_node = self.url_to_node[url]
+
+        for normalized_url in links:
+            normalized_url = self.canonical(normalized_url)
+            if normalized_url not in self.visited_urls:
+                self.urls_to_visit.note_link(normalized_url)
+                if normalized_url not in self.url_to_node:
+                    if self.robots and not self.robots.allowed(normalized_url):
+                        self.count("robots_disallowed")
+                        continue
+                    if not self.urls_to_visit.add(normalized_url, parent_node.depth + 1):
+                        # Over the crawl budget
+                        continue
+                    child_node = Node(normalized_url, parent_node.depth + 1)
+                    self.url_to_node[normalized_url] = child_node
+                    parent_node.add_child(child_node)
+                    if self.store:
+                        self.store.add_node(normalized_url, parent_node.url)
+                if normalized_url not in self.internal_urls:
+                    self.internal_urls.add(normalized_url)
+                    if self.store:
+                        self.store.mark_internal(normalized_url)
+        # Only after the children, a store closed in between still has the page pending
+        if self.store:
+            self.store.set_status(parent_node.url, "visited")
+
+    def page_failed(self, url):
+        """
+        Record that the page could not be fetched so a resumed crawl skips it
+        """
+        if self.store:
+            self.store.set_status(url, "failed")
+
+    def page_done(self):
+        if self.store:
+            self.store.page_done()
 
     def get_internal_urls(self):
         """
@@ -228,15 +3466,28 @@ class WebCrawler:
 
     # Function to extract the last word from the URL
     def get_last_word(self, url):
-        return url.rstrip('/').split('/')[-1]
+        url, _, query = url.partition("?")
+        last_word = url.rstrip('/').split('/')[-1]
+        if query:
+            # products?page=2 becomes products_page_2, a query can not go in a file name
+            last_word += "_" + re.sub(r"\W+", "_", query).strip("_")
+        return last_word
 
     def get_file_names(self):
 
         file_names = []
 
+        skip_near_duplicates = self.near_duplicates in ("skip-java", "prune")
+        # Pages still queued when the crawl stopped were never fetched, with a
+        # best-first frontier max_pages leaves the lower scored ones behind
+        not_crawled = set(self.urls_to_visit.pending_urls())
+
         def print_node(node):
-            last_word = self.get_last_word(node.url)
-            file_names.append(last_word)
+            if node.url in not_crawled:
+                return
+            if not (skip_near_duplicates and node.url in self.near_duplicate_of):
+                last_word = self.get_last_word(node.url)
+                file_names.append(last_word)
 
             for child in node.children:
                 print_node(child)
@@ -297,40 +3548,207 @@ def main():
     parser.add_argument("-u", "--username", type=str, help="Username for login")
     parser.add_argument("-p", "--password", type=str, help="Password for login")
     parser.add_argument("-f", "--output-directory", type=str, help="Directory name where java classes are created")
+    parser.add_argument("--concurrency", type=int, help="Crawl asynchronously with this many requests in flight")
+    parser.add_argument("--workers", type=int, help="Crawl with a pool of this many threads sharing the login cookies")
+    parser.add_argument("--no-politeness", action="store_true",
+                        help="Do not rate limit requests per host or back off on 429/503")
+    parser.add_argument("--parse-processes", type=int, help="Parse pages in a pool of this many processes (thread-pool crawl)")
+    parser.add_argument("--compact-visited", action="store_true",
+                        help="Keep the visited URL sets in a Bloom filter backed by on-disk SQLite instead of memory")
+    parser.add_argument("--visited-error-rate", type=float, default=0.01,
+                        help="False positive rate of the compact visited filter (each hit is confirmed on disk)")
+    parser.add_argument("--max-pages", type=int, help="Stop discovering pages after this many")
+    parser.add_argument("--max-depth", type=int, help="Do not follow links deeper than this many clicks from the domain URL")
+    parser.add_argument("--max-duration", "--deadline", type=float,
+                        help="Crawl deadline in seconds, the crawl then stops and keeps what it found so far")
+    parser.add_argument("--connect-timeout", type=float, default=10.0, help="Seconds to wait for a connection")
+    parser.add_argument("--read-timeout", type=float, default=30.0, help="Seconds to wait for data from the server")
+    parser.add_argument("--request-timeout", type=float, default=60.0, help="Seconds allowed for a whole page download")
+    parser.add_argument("--best-first", type=str, nargs="?", const="depth:1,inlinks:1,novelty:1,sitemap:1", metavar="SCORERS",
+                        help="Crawl the highest scoring URLs first, scorers are depth, inlinks, novelty and sitemap with optional weights, e.g. depth:1,novelty:2")
+    parser.add_argument("--http-cache", type=str, metavar="PATH",
+                        help="SQLite file caching pages between runs, unchanged pages are revalidated with conditional GETs")
+    parser.add_argument("--record", type=str, metavar="DIR", help="Write every fetched response to an archive in this directory")
+    parser.add_argument("--replay", type=str, metavar="DIR", help="Serve the crawl from a --record archive without using the network")
+    parser.add_argument("--max-page-bytes", type=int, default=5_000_000,
+                        help="Stop downloading pages larger than this many bytes")
+    parser.add_argument("--http2", action="store_true",
+                        help="Fetch with a shared httpx client multiplexing requests over HTTP/2")
+    parser.add_argument("--pool-size", type=int, default=10,
+                        help="Keep-alive connections per host (requests backend) or in total (--http2)")
+    parser.add_argument("--pool-hosts", type=int, default=10, help="Hosts to keep connection pools for (requests backend)")
+    parser.add_argument("--retries", type=int, default=3, help="Attempts per request before a page is deferred")
+    parser.add_argument("--retry-rounds", type=int, default=2,
+                        help="Rounds of retrying deferred pages once everything else is crawled")
+    parser.add_argument("--breaker-threshold", type=int, default=5,
+                        help="Consecutive failures after which a host is paused")
+    parser.add_argument("--robots", action="store_true",
+                        help="Obey robots.txt, its Crawl-delay is honoured unless --no-politeness is given")
+    parser.add_argument("--sitemap", action="store_true",
+                        help="Also crawl the sitemap pages no link leads to, and with --http-cache only refetch pages whose <lastmod> changed")
+    parser.add_argument("--link-extractor", choices=list(link_extractors), default=default_link_extractor,
+                        help="How links are found in pages, all give the same hierarchy")
+    parser.add_argument("--benchmark-extractors", action="store_true",
+                        help="Compare the link extractors' pages/sec on the --replay archive instead of crawling")
+    parser.add_argument("--stream-parse", action="store_true",
+                        help="Find links while pages download, with --workers their fetches start before the page is done")
+    parser.add_argument("--url-cache-size", type=int, default=100_000,
+                        help="Resolved links kept in the URL canonicalization cache")
+    parser.add_argument("--learn-duplicates", action="store_true",
+                        help="Learn URL rewrite rules from pages served under several URLs, kept in the HTTP cache")
+    parser.add_argument("--duplicate-support", type=int, default=2, metavar="N",
+                        help="Pairs of duplicate pages needed before a learned rule is applied")
+    parser.add_argument("--near-duplicates", choices=["report", "stop", "skip-java", "prune"],
+                        help="Detect template pages that differ in a few strings (SimHash) and report them, "
+                             "stop following their links, skip their Java classes, or prune (both)")
+    parser.add_argument("--near-duplicate-distance", type=int, default=3, metavar="BITS",
+                        help="SimHash bits out of 64 two pages may differ in and still be near-duplicates")
+    parser.add_argument("--scope-host", action="append", default=[], metavar="HOST",
+                        help="Also crawl this host and its subdomains, can be repeated")
+    parser.add_argument("--scope-path", action="append", default=[], metavar="PREFIX",
+                        help="Only crawl paths under this prefix, e.g. /management/client/dashboard, can be repeated")
+    parser.add_argument("--allow", action="append", default=[], metavar="REGEX",
+                        help="Only crawl URLs matching one of these patterns, can be repeated")
+    parser.add_argument("--deny", action="append", default=[], metavar="REGEX",
+                        help="Never crawl URLs matching this pattern, can be repeated")
+    parser.add_argument("--keep-param", action="append", default=None, metavar="NAME",
+                        help="Only keep this query parameter in URLs (e.g. page, id), can be repeated and use * patterns")
+    parser.add_argument("--drop-param", action="append", default=[], metavar="NAME",
+                        help="Also drop this query parameter from URLs, on top of the utm_* and session id ones, can be repeated")
+    parser.add_argument("--drop-query", action="store_true",
+                        help="Drop every query string, so URLs differing only in their query are one page")
+    parser.add_argument("--query-rules", metavar="FILE",
+                        help='JSON file of per-site query rules, {"host": {"keep": [...], "drop": [...]}}')
+    parser.add_argument("--distributed", type=str, metavar="WORKER_IDS",
+                        help="Comma separated worker ids of a distributed crawl, run as threads unless --queue-dir is given")
+    parser.add_argument("--queue-dir", type=str, help="Shared directory the distributed coordinator and workers exchange messages through")
+    parser.add_argument("--worker-id", type=str, help="Run as this worker of the --distributed crawl instead of the coordinator")
+    parser.add_argument("--crawl-id", type=str, help="Save the crawl state under this id so it can be resumed")
+    parser.add_argument("--resume", type=str, metavar="CRAWL_ID", help="Resume the saved crawl with this id")
+    parser.add_argument("--state-db", type=str, default="crawl_state.db", help="SQLite file holding saved crawls")
 
     args = parser.parse_args()
 
+    if (args.record or args.replay) and args.concurrency and not (args.workers or args.parse_processes):
+        parser.error("--record and --replay go through requests sessions, use --workers instead of --concurrency")
+    if args.stream_parse and (args.parse_processes or args.concurrency):
+        parser.error("--stream-parse parses in the fetching thread, use it with --workers or on its own")
+    if args.benchmark_extractors and not args.replay:
+        parser.error("--benchmark-extractors runs on a saved crawl, give it with --replay")
+    if (args.record or args.replay) and args.http2:
+        parser.error("--record and --replay go through requests sessions and cannot be used with --http2")
+
+    if args.http2:
+        backend = HttpxBackend(max_connections=max(args.pool_size, args.workers or 1), max_keepalive_connections=args.pool_size)
+    else:
+        backend = RequestsBackend(pool_connections=args.pool_hosts, pool_maxsize=args.pool_size)
+
     if args.get_sitemap:
         print("Crawling to get the sitemap...")
         domain_to_crawl = args.domain_url
 
-        if args.login:
-            login_url = args.login_url
-            username = args.username
-            password = args.password
-            crawler = WebCrawler(domain_to_crawl, login_url, username, password)
+        store = None
+        if args.resume:
+            store = CrawlStore(args.state_db, args.resume)
+            domain_to_crawl = store.base_url()
+            if not domain_to_crawl:
+                parser.error(f"No saved crawl '{args.resume}' in {args.state_db}")
+        elif args.crawl_id:
+            store = CrawlStore(args.state_db, args.crawl_id)
+            print(f"Saving crawl state as '{args.crawl_id}' in {args.state_db}")
+
+        keep_params = [] if args.drop_query else args.keep_param
+        if args.query_rules:
+            query_policy = QueryPolicy.from_file(args.query_rules, keep=keep_params, drop=args.drop_param)
         else:
-            crawler = WebCrawler(domain_to_crawl)
+            query_policy = QueryPolicy(keep=keep_params, drop=args.drop_param)
+        scope = ScopeMatcher([urlparse(domain_to_crawl).netloc] + args.scope_host, args.scope_path, args.allow, args.deny)
+        crawler_options = dict(
+            politeness=not args.no_politeness, store=store,
+            compact_visited=args.compact_visited, visited_error_rate=args.visited_error_rate,
+            max_pages=args.max_pages, max_depth=args.max_depth, max_duration=args.max_duration,
+            scorer=WeightedScorer.from_spec(args.best_first) if args.best_first else None,
+            http_cache=HttpCache(args.http_cache) if args.http_cache else None,
+            record=args.record, replay=args.replay, max_page_bytes=args.max_page_bytes, backend=backend,
+            max_attempts=args.retries, retry_rounds=args.retry_rounds,
+            breaker=CircuitBreaker(threshold=args.breaker_threshold),
+            connect_timeout=args.connect_timeout, read_timeout=args.read_timeout,
+            total_timeout=args.request_timeout, robots=args.robots, sitemap=args.sitemap,
+            link_extractor=link_extractors[args.link_extractor](), stream_parse=args.stream_parse,
+            url_cache_size=args.url_cache_size, scope=scope, query_policy=query_policy,
+            learn_duplicates=args.learn_duplicates, duplicate_support=args.duplicate_support,
+            near_duplicates=args.near_duplicates, near_duplicate_distance=args.near_duplicate_distance,
+        )
+        if args.login:
+            crawler_options.update(login_url=args.login_url, username=args.username, password=args.password)
+        crawler = WebCrawler(domain_to_crawl, **crawler_options)
 
-        crawler.crawl()
+        # Closes the store, the HTTP cache and the on-disk URL sets on every way out
+        try:
+            if args.benchmark_extractors:
+                crawler.benchmark_link_extractors()
+                return
 
-        internal_urls = crawler.get_internal_urls()
-        print(f"Found {len(internal_urls)} internal URLs:")
-        # for url in internal_urls:
-        #     print(url)
+            if args.distributed:
+                worker_ids = args.distributed.split(",")
+                backend = FileQueueBackend(args.queue_dir) if args.queue_dir else LocalQueueBackend()
+                if args.worker_id:
+                    crawler.run_worker(args.worker_id, worker_ids, backend)
+                    return
 
-        print("\nHierarchy of the web pages:")
-        crawler.print_hierarchy()
+            try:
+                if args.distributed:
+                    crawler.crawl_distributed(worker_ids, backend, local_workers=not args.queue_dir)
+                elif args.workers or args.parse_processes:
+                    crawler.crawl_threaded(args.workers or 8, args.parse_processes)
+                elif args.concurrency:
+                    crawler.crawl_async(args.concurrency)
+                else:
+                    crawler.crawl()
+            except KeyboardInterrupt:
+                if not store:
+                    raise
+                print(f"\nInterrupted, continue with --resume {store.crawl_id}")
+                return
 
-        # print("-----Printing Dictionary----")
-        # print(crawler.url_to_node)
-        if args.generate_java:
-            print("Generating Java class files...")
-            # Add logic to generate Java class files here
-            if args.output_directory:
-                crawler.generate_java_files(args.output_directory)
-            else:
-                crawler.generate_java_files()
+            if crawler.urls_to_visit.expired():
+                print(f"Crawl deadline reached, {len(crawler.urls_to_visit)} queued URLs were not crawled")
+            if crawler.stats:
+                print("Crawl stats: " + ", ".join(f"{name}={value}" for name, value in sorted(crawler.stats.items())))
+            if crawler.http_cache:
+                print(crawler.http_cache.report())
+            print(crawler.canonicalizer.report())
+            if crawler.near_duplicate_of:
+                print(f"{len(crawler.near_duplicate_of)} near-duplicate pages:")
+                for url, original in crawler.near_duplicate_of.items():
+                    print(f"    {url} ~ {original}")
+            connections = crawler.backend.connection_stats()
+            if connections["requests"]:
+                print(
+                    f"Connections ({crawler.backend.name}): {connections['requests']} requests over "
+                    f"{connections['connections']} connections, {connections['tls_handshakes']} TLS handshakes, "
+                    f"{connections['requests'] - connections['connections']} connections reused"
+                )
+
+            internal_urls = crawler.get_internal_urls()
+            print(f"Found {len(internal_urls)} internal URLs:")
+            # for url in internal_urls:
+            #     print(url)
+
+            print("\nHierarchy of the web pages:")
+            crawler.print_hierarchy()
+
+            # print("-----Printing Dictionary----")
+            # print(crawler.url_to_node)
+            if args.generate_java:
+                print("Generating Java class files...")
+                # Add logic to generate Java class files here
+                if args.output_directory:
+                    crawler.generate_java_files(args.output_directory)
+                else:
+                    crawler.generate_java_files()
+        finally:
+            crawler.close()
 
 '''
 # Future scope of work
@@ -0,0 +1,98 @@
+import functools
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class SiteHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves the site directory over keep-alive HTTP/1.1, with the server's
+    `redirects` answered as 301s
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        location = self.server.redirects.get(self.path)
+        if location is not None:
+            self.send_response(301)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.server.requests.append(self.path)
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+def page(title, links=()):
+    anchors = "".join(f'<a href="{href}">{href}</a>' for href in links)
+    return f"<html><head><title>{title}</title></head><body><h1>{title}</h1>{anchors}</body></html>"
+
+
+def make_site(sections=3, pages_per_section=4):
+    """
+    {path: html} of a small site: a shared nav menu, section pages listing
+    their pages, and pages linking to their siblings, with relative links,
+    fragments, a PDF and an external link mixed in
+    """
+    nav = ["/index.html"] + [f"/s{section}/index.html" for section in range(sections)]
+    pages = {"/index.html": page("home", nav + ["/doc.pdf", "https://example.com/x", "about.html#team"])}
+    pages["/about.html"] = page("about", nav)
+    for section in range(sections):
+        names = [f"p{number}.html" for number in range(pages_per_section)]
+        pages[f"/s{section}/index.html"] = page(f"section {section}", nav + names)
+        for number, name in enumerate(names):
+            siblings = names[number + 1:number + 3]
+            pages[f"/s{section}/{name}"] = page(f"section {section} page {number}", nav + siblings + ["../about.html"])
+    return pages
+
+
+@pytest.fixture
+def serve(tmp_path):
+    """
+    serve(pages, redirects=None) writes the {path: html} pages to a directory
+    and serves it on a free port, returning the base URL. The paths requested
+    are in `serve.requests`
+    """
+    servers = []
+
+    def start(pages, redirects=None):
+        root = tmp_path / f"site{len(servers)}"
+        for path, html in pages.items():
+            target = root / path.lstrip("/")
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_text(html)
+        root.mkdir(exist_ok=True)
+        handler = functools.partial(SiteHandler, directory=str(root))
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        server.redirects = redirects or {}
+        server.requests = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        start.requests = server.requests
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def tree(crawler):
+    """
+    The crawler's hierarchy as nested (url, children) tuples
+    """
+
+    def walk(node):
+        return node.url, tuple(walk(child) for child in node.children)
+
+    return walk(crawler.url_to_node[crawler.base_url])
@@ -0,0 +1,244 @@
+import pytest
+
+import qualibar_crawler as q
+from conftest import make_site, page, tree
+
+
+def crawl(base_url, mode="crawl", **kwargs):
+    crawler = q.WebCrawler(base_url + "/index.html", politeness=False, **kwargs)
+    if mode == "crawl":
+        crawler.crawl()
+    elif mode == "async":
+        crawler.crawl_async(8)
+    elif mode == "threaded":
+        crawler.crawl_threaded(8)
+    elif mode == "parse_processes":
+        crawler.crawl_threaded(4, parse_processes=2)
+    elif mode == "distributed":
+        crawler.crawl_distributed(["a", "b", "c"])
+    return crawler
+
+
+modes = ["async", "threaded", "parse_processes", "distributed"]
+
+
+def test_sequential_crawl(serve):
+    base = serve(make_site(sections=2, pages_per_section=2))
+    crawler = crawl(base)
+    assert tree(crawler) == (
+        f"{base}/index.html", (
+            (f"{base}/s0/index.html", ((f"{base}/s0/p0.html", ()), (f"{base}/s0/p1.html", ()))),
+            (f"{base}/s1/index.html", ((f"{base}/s1/p0.html", ()), (f"{base}/s1/p1.html", ()))),
+            (f"{base}/about.html", ()),
+        ),
+    )
+    # The PDF and the external link are not followed, the start page is not counted as a link
+    assert set(crawler.internal_urls) == set(crawler.url_to_node) - {crawler.base_url}
+    assert crawler.get_file_names() == ["index.html", "index.html", "p0.html", "p1.html", "index.html", "p0.html", "p1.html", "about.html"]
+
+
+@pytest.mark.parametrize("mode", modes)
+def test_modes_match_sequential(serve, mode):
+    base = serve(make_site())
+    expected = crawl(base)
+    crawler = crawl(base, mode)
+    assert tree(crawler) == tree(expected)
+    assert sorted(crawler.internal_urls) == sorted(expected.internal_urls)
+
+
+@pytest.mark.parametrize("mode", ["crawl", "threaded"])
+def test_stream_parse_matches(serve, mode):
+    base = serve(make_site())
+    assert tree(crawl(base, mode, stream_parse=True)) == tree(crawl(base))
+
+
+@pytest.mark.parametrize("extractor", list(q.link_extractors))
+def test_link_extractors_match(serve, extractor):
+    base = serve(make_site())
+    assert tree(crawl(base, link_extractor=q.link_extractors[extractor]())) == tree(crawl(base))
+
+
+@pytest.mark.parametrize("mode", ["crawl"] + modes)
+@pytest.mark.parametrize("budget", [{"max_depth": 1}, {"max_pages": 5}])
+def test_budgets_match_sequential(serve, mode, budget):
+    base = serve(make_site())
+    expected = crawl(base, **budget)
+    crawler = crawl(base, mode, **budget)
+    assert tree(crawler) == tree(expected)
+    assert len(crawler.url_to_node) <= budget.get("max_pages", len(crawler.url_to_node))
+
+
+@pytest.mark.parametrize("mode", ["crawl"] + modes)
+@pytest.mark.parametrize("scorer", [None, q.inlink_scorer])
+def test_page_budget_limits_fetches(serve, mode, scorer):
+    base = serve(make_site())
+    crawl(base, mode, max_pages=4, scorer=scorer)
+    assert len(serve.requests) == 4
+
+
+@pytest.mark.parametrize("mode", ["crawl"] + modes)
+def test_learned_duplicates_save_fetches(serve, mode):
+    # Every page is linked as both /pN/ and /pN/index.html
+    links = [link for number in range(30) for link in (f"/p{number}/", f"/p{number}/index.html")]
+    pages = {"/index.html": page("home", links)}
+    pages.update({f"/p{number}/index.html": page(f"page {number}", ["/index.html"]) for number in range(30)})
+    base = serve(pages)
+    crawl(base, "crawl", learn_duplicates=True)
+    sequential = len(serve.requests)
+    serve.requests.clear()
+    crawl(base, mode, learn_duplicates=True)
+    # Only the spellings fetched before the rule was learned, at most a window of them, are fetched twice
+    assert sequential < len(links)
+    assert len(serve.requests) <= sequential + 12
+
+
+def redirect_site():
+    """
+    /r1.html and /old.html are moved to /final.html, the home page links all three
+    """
+    pages = {
+        "/index.html": page("home", ["/final.html", "/r1.html", "/old.html"]),
+        "/final.html": page("final", ["/child.html", "/r1.html"]),
+        "/child.html": page("child", ["/old.html"]),
+    }
+    return pages, {"/r1.html": "/final.html", "/old.html": "/final.html"}
+
+
+@pytest.mark.parametrize("mode", ["crawl"] + modes)
+@pytest.mark.parametrize("cached", [False, True])
+def test_redirect_aliases_collapse(serve, mode, cached, tmp_path):
+    base = serve(*redirect_site())
+    crawler = crawl(base, mode, http_cache=q.HttpCache(str(tmp_path / "cache.db")) if cached else None)
+    assert tree(crawler) == (f"{base}/index.html", ((f"{base}/final.html", ((f"{base}/child.html", ()),)),))
+    assert sorted(crawler.internal_urls) == [f"{base}/child.html", f"{base}/final.html"]
+    assert crawler.get_file_names() == ["index.html", "final.html", "child.html"]
+    if mode == "crawl":
+        # Redirects to the crawled page are not followed
+        assert serve.requests.count("/final.html") == 1
+
+
+def test_renamed_page_is_resumed_under_final_url(serve, tmp_path):
+    pages, redirects = redirect_site()
+    # /final.html is only reached through the redirect, its node is /r1.html's renamed
+    pages["/index.html"] = page("home", ["/r1.html", "/old.html"])
+    base = serve(pages, redirects)
+    state = str(tmp_path / "state.db")
+    store = q.CrawlStore(state, "run")
+    crawler = q.WebCrawler(base + "/index.html", politeness=False, store=store)
+    crawler.crawl()
+    store.close()
+    assert tree(crawler) == (f"{base}/index.html", ((f"{base}/final.html", ((f"{base}/child.html", ()),)),))
+    rows = {url: status for url, _, _, status in q.CrawlStore(state, "run").load()}
+    assert rows[f"{base}/final.html"] == "visited"
+    assert rows[f"{base}/old.html"] == "alias"
+    assert f"{base}/r1.html" not in rows
+
+    serve.requests.clear()
+    store = q.CrawlStore(state, "run")
+    resumed = q.WebCrawler(base + "/index.html", politeness=False, store=store)
+    resumed.crawl()
+    store.close()
+    assert tree(resumed) == tree(crawler)
+    assert serve.requests == []
+
+
+def floorplan(number):
+    return f"<html><body><h1>Floorplan S{number}</h1><p>750 sq ft, 2 beds, 1 bath, balcony, parking</p>" \
+           "<ul><li>Kitchen</li><li>Laundry</li><li>Pool access</li></ul><a href='/index.html'>home</a></body></html>"
+
+
+@pytest.mark.parametrize("mode", ["crawl"] + modes)
+@pytest.mark.parametrize("spellings", [("/s{}/", "/s{}/index.html"), ("/s{}/index.html", "/s{}/")])
+def test_near_duplicates_skip_java_with_learned_duplicates(serve, mode, spellings):
+    # Near-identical floorplans, each linked under two spellings
+    links = [spelling.format(number) for number in range(1, 8) for spelling in spellings]
+    pages = {"/index.html": page("home", links)}
+    pages.update({f"/s{number}/index.html": floorplan(number) for number in range(1, 8)})
+    base = serve(pages)
+    crawler = crawl(base, mode, learn_duplicates=True, near_duplicates="skip-java")
+    # The home page and the first floorplan
+    assert len(crawler.get_file_names()) == 2
+
+
+def test_compact_visited_matches(serve):
+    base = serve(make_site())
+    crawler = crawl(base, compact_visited=True)
+    assert tree(crawler) == tree(crawl(base))
+    crawler.close()
+
+
+def test_resume_after_interrupt(serve, tmp_path):
+    base = serve(make_site())
+    expected = crawl(base)
+    state = str(tmp_path / "state.db")
+
+    store = q.CrawlStore(state, "run", checkpoint_every=1)
+    crawler = q.WebCrawler(base + "/index.html", politeness=False, store=store)
+    visit_url = crawler.visit_url
+    visited = []
+
+    def interrupt_after_five(url):
+        if len(visited) == 5:
+            raise KeyboardInterrupt
+        visited.append(url)
+        visit_url(url)
+
+    crawler.visit_url = interrupt_after_five
+    with pytest.raises(KeyboardInterrupt):
+        crawler.crawl()
+    store.close()
+
+    serve.requests.clear()
+    store = q.CrawlStore(state, "run")
+    resumed = q.WebCrawler(base + "/index.html", politeness=False, store=store)
+    resumed.crawl()
+    store.close()
+    assert tree(resumed) == tree(expected)
+    # Pages finished before the interrupt are not fetched again
+    assert not {url.removeprefix(base) for url in visited} & set(serve.requests)
+
+
+def test_resume_after_interrupt_while_queueing_links(serve, tmp_path):
+    base = serve(make_site())
+    expected = crawl(base)
+    state = str(tmp_path / "state.db")
+
+    store = q.CrawlStore(state, "run")
+    add_node = store.add_node
+
+    def interrupt_on_sixth_node(url, parent):
+        if store.next_seq == 6:
+            raise KeyboardInterrupt
+        add_node(url, parent)
+
+    store.add_node = interrupt_on_sixth_node
+    crawler = q.WebCrawler(base + "/index.html", politeness=False, store=store)
+    with pytest.raises(KeyboardInterrupt):
+        crawler.crawl()
+    # Like main(), the buffered writes are saved on the way out
+    store.close()
+
+    store = q.CrawlStore(state, "run")
+    resumed = q.WebCrawler(base + "/index.html", politeness=False, store=store)
+    resumed.crawl()
+    store.close()
+    assert tree(resumed) == tree(expected)
+
+
+def test_http_cache_reuses_unmodified_pages(serve, tmp_path):
+    base = serve(make_site())
+    cache = str(tmp_path / "cache.db")
+    first = crawl(base, http_cache=q.HttpCache(cache))
+    second = crawl(base, http_cache=q.HttpCache(cache))
+    assert tree(second) == tree(first)
+    assert len(second.http_cache.not_modified) == len(first.visited_urls)
+
+
+def test_replay_matches_recording(serve, tmp_path):
+    base = serve(make_site())
+    archive = str(tmp_path / "archive")
+    recorded = crawl(base, record=archive)
+    serve.requests.clear()
+    replayed = crawl(base, replay=archive)
+    assert tree(replayed) == tree(recorded)
+    assert serve.requests == []
@@ -21,6 +21,8 @@ from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 
+CONNECT_READ_TIMEOUT = (10, 30)
+
 
 class WebCrawler:
     """
@@ -146,7 +148,7 @@ class WebCrawler:
 
     def visit_url(self, url):
         try:
-            response = self.session.get(url)
+            response = self.session.get(url, timeout=CONNECT_READ_TIMEOUT)
             if response.status_code == 200:
                 self.visited_urls.add(url)
                 soup = BeautifulSoup(response.text, "html.parser")
@@ -16,6 +16,8 @@ from tqdm import tqdm
 from rich.progress import Progress, BarColumn, TextColumn
 import pyfiglet
 
+CONNECT_READ_TIMEOUT = (10, 30)
+
 
 class WebCrawler:
     """
@@ -98,7 +100,7 @@ class WebCrawler:
 
     def visit_url(self, url):
         try:
-            response = requests.get(url)
+            response = requests.get(url, timeout=CONNECT_READ_TIMEOUT)
             if response.status_code == 200:
                 self.visited_urls.add(url)
                 soup = BeautifulSoup(response.text, "html.parser")
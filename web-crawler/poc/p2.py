@@ -17,6 +17,8 @@ from rich.progress import Progress, BarColumn, TextColumn
 import pyfiglet
 import os
 
+CONNECT_READ_TIMEOUT = (10, 30)
+
 class_template = """
 public class {file_name} {{
     public {file_name}() {{
@@ -135,7 +137,7 @@ class WebCrawler:
 
     def visit_url(self, url):
         try:
-            response = requests.get(url)
+            response = requests.get(url, timeout=CONNECT_READ_TIMEOUT)
             if response.status_code == 200:
                 self.visited_urls.add(url)
                 soup = BeautifulSoup(response.text, "html.parser")